@@ -0,0 +1,167 @@
+"""
+Shared helpers for the Campus Cloud Lambda functions
+Purpose: AWS clients, DynamoDB marshalling and API response formatting
+"""
+
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import boto3
+import orjson
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# Every handler logs through the root logger, so LOG_LEVEL is applied once here
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+
+# Initialize AWS clients
+# Keep-alive and a shared session let warm invocations reuse open connections
+boto_config = Config(
+    tcp_keepalive=True,
+    max_pool_connections=50,
+    connect_timeout=2,
+    read_timeout=5,
+    retries={"max_attempts": 3, "mode": "standard"},
+)
+session = boto3.session.Session()
+s3_client = session.client("s3", config=boto_config)
+dynamodb_client = session.client("dynamodb", config=boto_config)
+
+
+class NumberDeserializer(TypeDeserializer):
+    """
+    TypeDeserializer that returns integral numbers as int instead of Decimal
+    """
+
+    def _deserialize_n(self, value):
+        # Counts, sizes and timestamps are whole numbers, and ints skip the
+        # decimal_default fallback when the response is encoded
+        if "." in value or "e" in value or "E" in value:
+            return super()._deserialize_n(value)
+        return int(value)
+
+
+# Marshal items ourselves instead of going through the boto3 resource layer
+serializer = TypeSerializer()
+deserializer = NumberDeserializer()
+
+# Environment variables
+FILES_TABLE = os.environ.get("FILES_TABLE", "campus-cloud-files")
+WARM_CLIENTS = os.environ.get("WARM_CLIENTS", "false").lower() == "true"
+BATCH_GET_LIMIT = 100
+BATCH_GET_MAX_RETRIES = 5
+
+# Response headers shared by every API response
+CORS_HEADERS = {
+    "Content-Type": "application/json",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Content-Type,Authorization",
+    "Access-Control-Allow-Methods": "GET,POST,PUT,DELETE,OPTIONS",
+}
+
+
+def utc_timestamp():
+    """
+    Return the current UTC time as an ISO 8601 string with a Z suffix
+    """
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def serialize_item(item):
+    """
+    Convert a Python dict into DynamoDB attribute values
+    """
+    return {key: serializer.serialize(value) for key, value in item.items()}
+
+
+def deserialize_item(item):
+    """
+    Convert DynamoDB attribute values into a Python dict
+    """
+    return {key: deserializer.deserialize(value) for key, value in item.items()}
+
+
+def build_projection(*attributes):
+    """
+    Build a ProjectionExpression and its ExpressionAttributeNames, using a
+    placeholder for every attribute so none can clash with a reserved word
+
+    The names can be shared as is: the resource layer deep-copies request
+    parameters before adding its own condition placeholders.
+    """
+    names = {f"#p{i}": attribute for i, attribute in enumerate(attributes)}
+    return ", ".join(names), names
+
+
+def batch_get_files(keys, projection=None, attribute_names=None):
+    """
+    Fetch files table items by primary key, keyed by fileId
+    """
+    files_by_id = {}
+
+    # BatchGetItem accepts at most 100 keys per request
+    for start in range(0, len(keys), BATCH_GET_LIMIT):
+        table_request = {
+            "Keys": [
+                serialize_item(key) for key in keys[start : start + BATCH_GET_LIMIT]
+            ]
+        }
+        if projection:
+            table_request["ProjectionExpression"] = projection
+        if attribute_names:
+            table_request["ExpressionAttributeNames"] = attribute_names
+
+        request_items = {FILES_TABLE: table_request}
+        attempt = 0
+
+        while request_items:
+            try:
+                response = dynamodb_client.batch_get_item(RequestItems=request_items)
+            except ClientError as e:
+                logger.error(f"Error getting file metadata: {str(e)}")
+                break
+
+            for item in response["Responses"].get(FILES_TABLE, []):
+                file_item = deserialize_item(item)
+                files_by_id[file_item["fileId"]] = file_item
+
+            # Retry throttled keys with exponential backoff
+            request_items = response.get("UnprocessedKeys")
+            if request_items:
+                if attempt >= BATCH_GET_MAX_RETRIES:
+                    logger.warning("Giving up on unprocessed file keys")
+                    break
+                time.sleep(0.05 * (2**attempt))
+                attempt += 1
+
+    return files_by_id
+
+
+def create_response(status_code, body):
+    """
+    Create HTTP response with CORS headers
+    """
+    return {
+        "statusCode": status_code,
+        "headers": CORS_HEADERS,
+        "body": orjson.dumps(body, default=decimal_default).decode(),
+    }
+
+
+def decimal_default(obj):
+    """
+    JSON serializer for Decimal objects
+    """
+    if isinstance(obj, Decimal):
+        # Integral values have a non-negative exponent, which is cheaper to
+        # check than Decimal modulo; NaN and Infinity carry a str exponent
+        exponent = obj.as_tuple().exponent
+        if isinstance(exponent, int) and exponent >= 0:
+            return int(obj)
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
@@ -6,19 +6,25 @@ Purpose: Marks file upload as complete and updates DynamoDB metadata
 import json
 import logging
 import os
-from datetime import datetime
-from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
 from botocore.exceptions import ClientError
 
-# Configure logging
+from common import (
+    WARM_CLIENTS,
+    create_response,
+    deserialize_item,
+    dynamodb_client,
+    s3_client,
+    serialize_item,
+    utc_timestamp,
+)
+
+# Configure logging (the level is set from LOG_LEVEL in common)
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
 
-# Initialize AWS clients
-s3_client = boto3.client("s3")
-dynamodb = boto3.resource("dynamodb")
+# Worker threads for overlapping independent AWS calls
+executor = ThreadPoolExecutor(max_workers=2)
 
 # Environment variables
 FILES_TABLE = os.environ.get("FILES_TABLE", "campus-cloud-files")
@@ -33,11 +39,14 @@ def lambda_handler(event, context):
     using a presigned URL. It verifies the upload and updates the file status.
     """
     try:
-        logger.info(f"Event: {json.dumps(event)}")
+        # Only serialize the full event when debug logging is enabled
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Event: {json.dumps(event)}")
 
         # Extract user info from authorizer context
         user_id = event["requestContext"]["authorizer"]["claims"]["sub"]
         user_email = event["requestContext"]["authorizer"]["claims"]["email"]
+        timestamp = utc_timestamp()
 
         # Extract file ID from path parameters
         path_params = event.get("pathParameters", {})
@@ -56,18 +65,23 @@ def lambda_handler(event, context):
 
         if not upload_success:
             logger.warning(f"Upload marked as failed for file {file_id}")
-            return handle_failed_upload(user_id, file_id)
+            return handle_failed_upload(user_id, file_id, timestamp)
 
         if not s3_key:
             return create_response(
                 400, {"error": "Bad Request", "message": "S3 key is required"}
             )
 
-        # Get file metadata from DynamoDB
-        table = dynamodb.Table(FILES_TABLE)
+        # Start the S3 check in the background while the metadata is fetched
+        head_future = executor.submit(
+            s3_client.head_object, Bucket=S3_BUCKET, Key=s3_key
+        )
 
+        # Get file metadata from DynamoDB
         try:
-            response = table.get_item(Key={"userId": user_id, "fileId": file_id})
+            response = dynamodb_client.get_item(
+                TableName=FILES_TABLE, Key=file_key(user_id, file_id)
+            )
         except ClientError as e:
             logger.error(f"DynamoDB error: {str(e)}")
             return create_response(
@@ -83,7 +97,7 @@ def lambda_handler(event, context):
                 404, {"error": "Not Found", "message": "File not found"}
             )
 
-        file_item = response["Item"]
+        file_item = deserialize_item(response["Item"])
 
         # Verify file belongs to user
         if file_item["userId"] != user_id:
@@ -105,7 +119,7 @@ def lambda_handler(event, context):
 
         # Verify file exists in S3
         try:
-            s3_response = s3_client.head_object(Bucket=S3_BUCKET, Key=s3_key)
+            s3_response = head_future.result()
             actual_file_size = s3_response["ContentLength"]
             s3_etag = s3_response.get("ETag", "").strip('"')
 
@@ -127,8 +141,6 @@ def lambda_handler(event, context):
                 )
 
         # Update file status in DynamoDB
-        timestamp = datetime.utcnow().isoformat() + "Z"
-
         update_expression = "SET #status = :status, lastModified = :timestamp"
         expression_attribute_names = {"#status": "status"}
         expression_attribute_values = {
@@ -154,12 +166,14 @@ def lambda_handler(event, context):
         expression_attribute_values[":virusScanStatus"] = "pending"
 
         try:
-            table.update_item(
-                Key={"userId": user_id, "fileId": file_id},
+            update_response = dynamodb_client.update_item(
+                TableName=FILES_TABLE,
+                Key=file_key(user_id, file_id),
                 UpdateExpression=update_expression,
                 ExpressionAttributeNames=expression_attribute_names,
-                ExpressionAttributeValues=expression_attribute_values,
+                ExpressionAttributeValues=serialize_item(expression_attribute_values),
                 ConditionExpression="attribute_exists(fileId)",
+                ReturnValues="ALL_NEW",
             )
         except ClientError as e:
             if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
@@ -176,9 +190,8 @@ def lambda_handler(event, context):
                     },
                 )
 
-        # Get updated item
-        response = table.get_item(Key={"userId": user_id, "fileId": file_id})
-        updated_file = response["Item"]
+        # The update returns the new item, so no follow-up read is needed
+        updated_file = deserialize_item(update_response["Attributes"])
 
         logger.info(f"Upload completed successfully for file {file_id}")
 
@@ -208,21 +221,19 @@ def lambda_handler(event, context):
         )
 
 
-def handle_failed_upload(user_id, file_id):
+def handle_failed_upload(user_id, file_id, timestamp):
     """
     Handle failed upload by marking file as failed in DynamoDB
     """
     try:
-        table = dynamodb.Table(FILES_TABLE)
-        timestamp = datetime.utcnow().isoformat() + "Z"
-
-        table.update_item(
-            Key={"userId": user_id, "fileId": file_id},
+        dynamodb_client.update_item(
+            TableName=FILES_TABLE,
+            Key=file_key(user_id, file_id),
             UpdateExpression="SET #status = :status, lastModified = :timestamp",
             ExpressionAttributeNames={"#status": "status"},
             ExpressionAttributeValues={
-                ":status": "failed",
-                ":timestamp": timestamp,
+                ":status": {"S": "failed"},
+                ":timestamp": {"S": timestamp},
             },
         )
 
@@ -248,6 +259,13 @@ def handle_failed_upload(user_id, file_id):
         )
 
 
+def file_key(user_id, file_id):
+    """
+    Build the low-level primary key for a files table item
+    """
+    return {"userId": {"S": user_id}, "fileId": {"S": file_id}}
+
+
 def format_file_response(file_item, user_email):
     """
     Format file item for API response
@@ -255,7 +273,7 @@ def format_file_response(file_item, user_email):
     return {
         "fileId": file_item["fileId"],
         "filename": file_item["filename"],
-        "fileSize": int(file_item["fileSize"]),
+        "fileSize": file_item["fileSize"],
         "contentType": file_item["contentType"],
         "uploadedAt": file_item["uploadedAt"],
         "lastModified": file_item.get("lastModified", file_item["uploadedAt"]),
@@ -268,32 +286,24 @@ def format_file_response(file_item, user_email):
         "description": file_item.get("description", ""),
         "tags": file_item.get("tags", []),
         "metadata": file_item.get("metadata", {}),
-        "downloadCount": int(file_item.get("downloadCount", 0)),
+        "downloadCount": file_item.get("downloadCount", 0),
         "checksum": file_item.get("checksum"),
         "virusScanStatus": file_item.get("virusScanStatus", "pending"),
     }
 
 
-def create_response(status_code, body):
+def warm_clients():
     """
-    Create HTTP response with CORS headers
+    Open the DynamoDB and S3 connections during INIT so the first request
+    does not pay for endpoint resolution and the TLS handshake
     """
-    return {
-        "statusCode": status_code,
-        "headers": {
-            "Content-Type": "application/json",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Headers": "Content-Type,Authorization",
-            "Access-Control-Allow-Methods": "GET,POST,PUT,DELETE,OPTIONS",
-        },
-        "body": json.dumps(body, default=decimal_default),
-    }
+    try:
+        dynamodb_client.describe_table(TableName=FILES_TABLE)
+        s3_client.head_bucket(Bucket=S3_BUCKET)
+    except Exception as e:
+        logger.warning(f"Client warmup failed: {str(e)}")
 
 
-def decimal_default(obj):
-    """
-    JSON serializer for Decimal objects
-    """
-    if isinstance(obj, Decimal):
-        return int(obj) if obj % 1 == 0 else float(obj)
-    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+# Prime connections at cold start when enabled
+if WARM_CLIENTS:
+    warm_clients()
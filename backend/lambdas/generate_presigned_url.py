@@ -6,22 +6,32 @@ Purpose: Creates S3 presigned URLs for file uploads and downloads
 import json
 import logging
 import os
+import time
 import uuid
-from datetime import datetime, timedelta
-from decimal import Decimal
-
-import boto3
-
-# Configure logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+from urllib.parse import quote
+
+from common import (
+    WARM_CLIENTS,
+    create_response,
+    deserialize_item,
+    dynamodb_client,
+    s3_client,
+    serialize_item,
+    utc_timestamp,
+)
+
+# Configure logging (the level is set from LOG_LEVEL in common)
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
 
-# Initialize AWS clients
-s3_client = boto3.client("s3")
-dynamodb = boto3.resource("dynamodb")
+# Worker threads for DynamoDB writes that the response does not depend on
+executor = ThreadPoolExecutor(max_workers=2)
 
 # Environment variables
 FILES_TABLE = os.environ.get("FILES_TABLE", "campus-cloud-files")
+SHARES_TABLE = os.environ.get("SHARES_TABLE", "campus-cloud-shares")
 S3_BUCKET = os.environ.get("S3_BUCKET", "campus-cloud-files-bucket")
 UPLOAD_URL_EXPIRATION = int(os.environ.get("UPLOAD_URL_EXPIRATION", "300"))  # 5 minutes
 DOWNLOAD_URL_EXPIRATION = int(
@@ -29,25 +39,34 @@ DOWNLOAD_URL_EXPIRATION = int(
 )  # 15 minutes
 MAX_FILE_SIZE = int(os.environ.get("MAX_FILE_SIZE", "104857600"))  # 100MB
 
+# Download URLs are reused within a container for the first third of their
+# lifetime, so repeated downloads of a file skip SigV4 signing
+DOWNLOAD_URL_REUSE_SECONDS = DOWNLOAD_URL_EXPIRATION // 3
+DOWNLOAD_URL_CACHE_SIZE = 256
+download_url_cache = {}
+
 # Allowed file types (MIME types)
-ALLOWED_CONTENT_TYPES = [
-    "application/pdf",
-    "application/msword",
-    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-    "application/vnd.ms-excel",
-    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    "application/vnd.ms-powerpoint",
-    "application/vnd.openxmlformats-officedocument.presentationml.presentation",
-    "text/plain",
-    "text/csv",
-    "image/jpeg",
-    "image/png",
-    "image/gif",
-    "application/zip",
-    "application/x-zip-compressed",
-    "video/mp4",
-    "video/mpeg",
-]
+ALLOWED_CONTENT_TYPES = frozenset(
+    [
+        "application/pdf",
+        "application/msword",
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        "application/vnd.ms-excel",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "application/vnd.ms-powerpoint",
+        "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+        "text/plain",
+        "text/csv",
+        "image/jpeg",
+        "image/png",
+        "image/gif",
+        "application/zip",
+        "application/x-zip-compressed",
+        "video/mp4",
+        "video/mpeg",
+    ]
+)
+ALLOWED_CONTENT_TYPES_LIST = sorted(ALLOWED_CONTENT_TYPES)
 
 
 def lambda_handler(event, context):
@@ -57,23 +76,22 @@ def lambda_handler(event, context):
     Supports both upload and download presigned URL generation
     """
     try:
-        logger.info(f"Event: {json.dumps(event)}")
+        # Only serialize the full event when debug logging is enabled
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Event: {json.dumps(event)}")
 
         # Extract user info from authorizer context
         user_id = event["requestContext"]["authorizer"]["claims"]["sub"]
         user_email = event["requestContext"]["authorizer"]["claims"]["email"]
 
-        # Determine request type (upload or download)
-        http_method = event["httpMethod"]
-        path = event["path"]
+        # Determine request type from the API Gateway resource template
+        handler = ROUTES.get((event["httpMethod"], event.get("resource")))
 
-        if http_method == "POST" and "/upload-url" in path:
-            return handle_upload_url(event, user_id, user_email)
-        elif http_method == "POST" and "/download-url" in path:
-            return handle_download_url(event, user_id, user_email)
-        else:
+        if handler is None:
             return create_response(400, {"error": "Invalid request"})
 
+        return handler(event, user_id, user_email)
+
     except KeyError as e:
         logger.error(f"Missing required field: {str(e)}")
         return create_response(
@@ -131,27 +149,29 @@ def handle_upload_url(event, user_id, user_email):
         )
 
         # Store pending upload in DynamoDB
-        table = dynamodb.Table(FILES_TABLE)
-        timestamp = datetime.utcnow().isoformat() + "Z"
+        timestamp = utc_timestamp()
 
-        table.put_item(
-            Item={
-                "userId": user_id,
-                "fileId": file_id,
-                "filename": filename,
-                "fileSize": file_size,
-                "contentType": content_type,
-                "s3Key": s3_key,
-                "s3Bucket": S3_BUCKET,
-                "status": "pending",
-                "uploadedAt": timestamp,
-                "lastModified": timestamp,
-                "description": metadata.get("description", ""),
-                "tags": metadata.get("tags", []),
-                "metadata": metadata,
-                "downloadCount": 0,
-                "isPublic": False,
-            }
+        dynamodb_client.put_item(
+            TableName=FILES_TABLE,
+            Item=serialize_item(
+                {
+                    "userId": user_id,
+                    "fileId": file_id,
+                    "filename": filename,
+                    "fileSize": file_size,
+                    "contentType": content_type,
+                    "s3Key": s3_key,
+                    "s3Bucket": S3_BUCKET,
+                    "status": "pending",
+                    "uploadedAt": timestamp,
+                    "lastModified": timestamp,
+                    "description": metadata.get("description", ""),
+                    "tags": metadata.get("tags", []),
+                    "metadata": metadata,
+                    "downloadCount": 0,
+                    "isPublic": False,
+                }
+            ),
         )
 
         logger.info(f"Generated upload URL for file {file_id}")
@@ -193,28 +213,40 @@ def handle_download_url(event, user_id, user_email):
                 400, {"error": "Bad Request", "message": "File ID is required"}
             )
 
-        # Get file metadata from DynamoDB
-        table = dynamodb.Table(FILES_TABLE)
-
-        # First, try to get the file by fileId using GSI
-        response = table.query(
-            IndexName="FileIdIndex",
-            KeyConditionExpression="fileId = :fid",
-            ExpressionAttributeValues={":fid": file_id},
+        # Most downloads are by the owner, so try a direct key lookup first
+        response = dynamodb_client.get_item(
+            TableName=FILES_TABLE,
+            Key={"userId": {"S": user_id}, "fileId": {"S": file_id}},
         )
 
-        if not response["Items"]:
-            return create_response(
-                404, {"error": "Not Found", "message": "File not found"}
+        share_future = None
+        if "Item" in response:
+            file_item = deserialize_item(response["Item"])
+        else:
+            # Not the owner's file; look up the share while the FileIdIndex
+            # GSI query runs so both round-trips overlap
+            share_future = executor.submit(check_file_share_access, file_id, user_id)
+            response = dynamodb_client.query(
+                TableName=FILES_TABLE,
+                IndexName="FileIdIndex",
+                KeyConditionExpression="fileId = :fid",
+                ExpressionAttributeValues={":fid": {"S": file_id}},
             )
 
-        file_item = response["Items"][0]
+            if not response["Items"]:
+                return create_response(
+                    404, {"error": "Not Found", "message": "File not found"}
+                )
+
+            file_item = deserialize_item(response["Items"][0])
 
         # Check if user has access (owner or shared)
         has_access = False
 
         if file_item["userId"] == user_id:
             has_access = True
+        elif share_future is not None:
+            has_access = share_future.result()
         else:
             # Check if file is shared with user
             has_access = check_file_share_access(file_id, user_id)
@@ -239,24 +271,12 @@ def handle_download_url(event, user_id, user_email):
             )
 
         # Generate presigned GET URL
-        s3_key = file_item["s3Key"]
-        download_url = s3_client.generate_presigned_url(
-            "get_object",
-            Params={
-                "Bucket": S3_BUCKET,
-                "Key": s3_key,
-                "ResponseContentDisposition": f'attachment; filename="{file_item["filename"]}"',
-                "ResponseContentType": file_item["contentType"],
-            },
-            ExpiresIn=DOWNLOAD_URL_EXPIRATION,
+        download_url, expires_in = get_download_url(
+            file_item["s3Key"], file_item["filename"], file_item["contentType"]
         )
 
-        # Update download count
-        table.update_item(
-            Key={"userId": file_item["userId"], "fileId": file_id},
-            UpdateExpression="SET downloadCount = downloadCount + :inc",
-            ExpressionAttributeValues={":inc": 1},
-        )
+        # Update download count in the background; the response does not need it
+        executor.submit(increment_download_count, file_item["userId"], file_id)
 
         logger.info(f"Generated download URL for file {file_id}")
 
@@ -266,8 +286,8 @@ def handle_download_url(event, user_id, user_email):
                 "downloadUrl": download_url,
                 "filename": file_item["filename"],
                 "contentType": file_item["contentType"],
-                "fileSize": int(file_item["fileSize"]),
-                "expiresIn": DOWNLOAD_URL_EXPIRATION,
+                "fileSize": file_item["fileSize"],
+                "expiresIn": expires_in,
             },
         )
 
@@ -278,6 +298,13 @@ def handle_download_url(event, user_id, user_email):
         )
 
 
+# Route table keyed by (HTTP method, API Gateway resource template)
+ROUTES = {
+    ("POST", "/files/upload-url"): handle_upload_url,
+    ("POST", "/files/{fileId}/download-url"): handle_download_url,
+}
+
+
 def validate_upload_request(filename, content_type, file_size):
     """
     Validate upload request parameters
@@ -294,7 +321,7 @@ def validate_upload_request(filename, content_type, file_size):
         return {
             "error": "Bad Request",
             "message": f"Content type {content_type} is not allowed",
-            "allowedTypes": ALLOWED_CONTENT_TYPES,
+            "allowedTypes": ALLOWED_CONTENT_TYPES_LIST,
         }
 
     # Check file size
@@ -311,33 +338,106 @@ def validate_upload_request(filename, content_type, file_size):
     return None
 
 
-def check_file_share_access(file_id, user_id):
+def get_download_url(s3_key, filename, content_type):
     """
-    Check if file is shared with user
+    Return a presigned GET URL and the number of seconds it remains valid
+
+    A URL signed earlier in this container is returned again while it is
+    within DOWNLOAD_URL_REUSE_SECONDS of being issued.
+    """
+    now = time.time()
+    cache_key = (s3_key, filename, content_type)
+
+    cached = download_url_cache.get(cache_key)
+    if cached and now - cached[1] < DOWNLOAD_URL_REUSE_SECONDS:
+        download_url, issued_at = cached
+        return download_url, int(issued_at + DOWNLOAD_URL_EXPIRATION - now)
+
+    download_url = s3_client.generate_presigned_url(
+        "get_object",
+        Params={
+            "Bucket": S3_BUCKET,
+            "Key": s3_key,
+            "ResponseContentDisposition": content_disposition(filename),
+            "ResponseContentType": content_type,
+        },
+        ExpiresIn=DOWNLOAD_URL_EXPIRATION,
+    )
+
+    # Evict the oldest entry once the cache is full
+    if cache_key not in download_url_cache:
+        if len(download_url_cache) >= DOWNLOAD_URL_CACHE_SIZE:
+            del download_url_cache[next(iter(download_url_cache))]
+    download_url_cache[cache_key] = (download_url, now)
+
+    return download_url, DOWNLOAD_URL_EXPIRATION
+
+
+@lru_cache(maxsize=256)
+def content_disposition(filename):
+    """
+    Build the attachment Content-Disposition header for a download
+
+    Non-ASCII, control and quote characters are replaced in the plain
+    filename and kept intact in the RFC 5987 encoded filename* parameter.
+    """
+    fallback = "".join(
+        char if 32 <= ord(char) < 127 and char not in '"\\' else "_"
+        for char in filename
+    )
+    encoded = quote(filename, safe="")
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{encoded}"
+
+
+def increment_download_count(owner_id, file_id):
+    """
+    Increment the download counter for a file
+
+    Runs on the background executor, so failures are logged and not raised.
+    If the sandbox is frozen before the write finishes, it completes on the
+    next invocation.
     """
     try:
-        shares_table = dynamodb.Table(
-            os.environ.get("SHARES_TABLE", "campus-cloud-shares")
+        dynamodb_client.update_item(
+            TableName=FILES_TABLE,
+            Key={"userId": {"S": owner_id}, "fileId": {"S": file_id}},
+            UpdateExpression="SET downloadCount = if_not_exists(downloadCount, :zero) + :inc",
+            ExpressionAttributeValues={":inc": {"N": "1"}, ":zero": {"N": "0"}},
         )
+    except Exception as e:
+        logger.error(f"Error updating download count for {file_id}: {str(e)}")
+
 
-        response = shares_table.query(
+def check_file_share_access(file_id, user_id):
+    """
+    Check if file is shared with user
+    """
+    try:
+        response = dynamodb_client.query(
+            TableName=SHARES_TABLE,
             KeyConditionExpression="fileId = :fid AND sharedWithUserId = :uid",
-            ExpressionAttributeValues={":fid": file_id, ":uid": user_id},
+            ExpressionAttributeValues={":fid": {"S": file_id}, ":uid": {"S": user_id}},
         )
 
         if response["Items"]:
-            share = response["Items"][0]
+            share = deserialize_item(response["Items"][0])
 
             # Check if share is active
             if share["status"] != "active":
                 return False
 
-            # Check if share has expired
-            if "expiresAt" in share:
+            # Check if share has expired, preferring the epoch ttl attribute
+            # over parsing the expiresAt string
+            if "ttl" in share:
+                if int(time.time()) > share["ttl"]:
+                    return False
+            elif "expiresAt" in share:
                 expiry = datetime.fromisoformat(
                     share["expiresAt"].replace("Z", "+00:00")
                 )
-                if datetime.utcnow().replace(tzinfo=expiry.tzinfo) > expiry:
+                if expiry.tzinfo is None:
+                    expiry = expiry.replace(tzinfo=timezone.utc)
+                if datetime.now(timezone.utc) > expiry:
                     return False
 
             return True
@@ -349,26 +449,23 @@ def check_file_share_access(file_id, user_id):
         return False
 
 
-def create_response(status_code, body):
+def warm_clients():
     """
-    Create HTTP response with CORS headers
+    Open the DynamoDB connection during INIT so the first request does not
+    pay for endpoint resolution and the TLS handshake
+
+    The S3 client only signs URLs locally, so signing a throwaway URL is
+    enough to resolve its endpoint, credentials and signer up front.
     """
-    return {
-        "statusCode": status_code,
-        "headers": {
-            "Content-Type": "application/json",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Headers": "Content-Type,Authorization",
-            "Access-Control-Allow-Methods": "GET,POST,PUT,DELETE,OPTIONS",
-        },
-        "body": json.dumps(body, default=decimal_default),
-    }
+    try:
+        dynamodb_client.describe_table(TableName=FILES_TABLE)
+        s3_client.generate_presigned_url(
+            "get_object", Params={"Bucket": S3_BUCKET, "Key": "warmup"}, ExpiresIn=1
+        )
+    except Exception as e:
+        logger.warning(f"Client warmup failed: {str(e)}")
 
 
-def decimal_default(obj):
-    """
-    JSON serializer for Decimal objects
-    """
-    if isinstance(obj, Decimal):
-        return int(obj) if obj % 1 == 0 else float(obj)
-    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+# Prime connections at cold start when enabled
+if WARM_CLIENTS:
+    warm_clients()
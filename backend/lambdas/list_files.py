@@ -6,25 +6,55 @@ Purpose: Retrieves list of files owned by or shared with the authenticated user
 import json
 import logging
 import os
-from datetime import datetime
-from decimal import Decimal
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
-from boto3.dynamodb.conditions import Attr, Key
 from botocore.exceptions import ClientError
 
-# Configure logging
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+from common import (
+    batch_get_files,
+    build_projection,
+    create_response,
+    deserialize_item,
+    dynamodb_client,
+    serialize_item,
+)
 
-# Initialize AWS clients
-dynamodb = boto3.resource("dynamodb")
+# Configure logging (the level is set from LOG_LEVEL in common)
+logger = logging.getLogger()
 
 # Environment variables
 FILES_TABLE = os.environ.get("FILES_TABLE", "campus-cloud-files")
 SHARES_TABLE = os.environ.get("SHARES_TABLE", "campus-cloud-shares")
 DEFAULT_LIMIT = 20
 MAX_LIMIT = 100
+ALL_FILE_SOURCES = ("owned", "shared")
+VALID_FILTERS = frozenset(["all", "owned", "shared"])
+VALID_SORT_FIELDS = frozenset(["uploadedAt", "filename", "fileSize", "lastModified"])
+
+# Only the attributes format_file_item reads; every name goes through a
+# placeholder since some of them (status among others) are reserved words
+FILE_PROJECTION, FILE_PROJECTION_NAMES = build_projection(
+    "fileId",
+    "filename",
+    "fileSize",
+    "contentType",
+    "uploadedAt",
+    "lastModified",
+    "status",
+    "userId",
+    "ownerEmail",
+    "description",
+    "tags",
+    "downloadCount",
+    "virusScanStatus",
+    "sharedWithCount",
+)
+
+# Worker threads for overlapping independent AWS calls. Queries go through
+# the low-level client because the resource layer's condition builder keeps
+# per-call state and is not safe to share between threads
+executor = ThreadPoolExecutor(max_workers=2)
 
 
 def lambda_handler(event, context):
@@ -34,7 +64,9 @@ def lambda_handler(event, context):
     Supports filtering, sorting, and pagination
     """
     try:
-        logger.info(f"Event: {json.dumps(event)}")
+        # Only serialize the full event when debug logging is enabled
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Event: {json.dumps(event)}")
 
         # Extract user info from authorizer context
         user_id = event["requestContext"]["authorizer"]["claims"]["sub"]
@@ -46,13 +78,20 @@ def lambda_handler(event, context):
         limit = int(query_params.get("limit", DEFAULT_LIMIT))
         limit = min(limit, MAX_LIMIT)  # Enforce max limit
 
+        # A page of no files would hand back a token that never advances
+        if limit < 1:
+            return create_response(
+                400,
+                {"error": "Bad Request", "message": "Limit must be at least 1"},
+            )
+
         next_token = query_params.get("nextToken")
         filter_type = query_params.get("filter", "all")  # all, owned, shared
         sort_by = query_params.get("sortBy", "uploadedAt")
         sort_order = query_params.get("sortOrder", "desc")
 
         # Validate filter type
-        if filter_type not in ["all", "owned", "shared"]:
+        if filter_type not in VALID_FILTERS:
             return create_response(
                 400,
                 {
@@ -67,21 +106,12 @@ def lambda_handler(event, context):
         elif filter_type == "shared":
             files = get_shared_files(user_id, limit, next_token)
         else:  # all
-            owned_files = get_owned_files(user_id, limit, next_token, sort_order)
-            shared_files = get_shared_files(user_id, limit, next_token)
-
-            # Combine and sort
-            all_files = owned_files["files"] + shared_files["files"]
-            all_files = sort_files(all_files, sort_by, sort_order)
-
-            files = {
-                "files": all_files[:limit],
-                "total": owned_files["total"] + shared_files["total"],
-                "nextToken": None,  # Simplified for combined view
-            }
+            files = get_all_files(user_id, limit, next_token, sort_by, sort_order)
 
         # Format response
-        formatted_files = [format_file_item(f, user_id) for f in files["files"]]
+        formatted_files = files["files"]
+        for file_item in formatted_files:
+            format_file_item(file_item, user_id)
 
         response_body = {
             "files": formatted_files,
@@ -106,17 +136,103 @@ def lambda_handler(event, context):
         )
 
 
+def get_all_files(user_id, limit, next_token, sort_by, sort_order):
+    """
+    Get owned and shared files together, paging each source separately
+    """
+    # The combined token holds one cursor per source, null for a source not
+    # read yet; a source that has been read to the end is left out of it
+    if next_token:
+        token = json.loads(next_token)
+        if not isinstance(token, dict):
+            raise ValueError("Invalid next token")
+        cursors = {
+            source: token[source]
+            for source in ALL_FILE_SOURCES
+            if source in token and isinstance(token[source], (str, type(None)))
+        }
+    else:
+        cursors = {source: None for source in ALL_FILE_SOURCES}
+
+    files = []
+    remaining = limit
+
+    # Split the page between the sources, then top up once from whichever
+    # source still has rows if the first round came back short
+    for _ in range(2):
+        sources = [source for source in ALL_FILE_SOURCES if source in cursors]
+        if remaining <= 0 or not sources:
+            break
+
+        base, extra = divmod(remaining, len(sources))
+        limits = {
+            source: base + (1 if i < extra else 0) for i, source in enumerate(sources)
+        }
+        sources = [source for source in sources if limits[source] > 0]
+
+        # Sources live in different tables, so fetch them at the same time
+        futures = {
+            source: executor.submit(
+                fetch_files,
+                source,
+                user_id,
+                limits[source],
+                cursors[source],
+                sort_order,
+            )
+            for source in sources[1:]
+        }
+        results = {
+            sources[0]: fetch_files(
+                sources[0], user_id, limits[sources[0]], cursors[sources[0]], sort_order
+            )
+        }
+        for source, future in futures.items():
+            results[source] = future.result()
+
+        for source, result in results.items():
+            files.extend(result["files"])
+            remaining -= len(result["files"])
+
+            if result["nextToken"]:
+                cursors[source] = result["nextToken"]
+            else:
+                del cursors[source]
+
+    return {
+        "files": sort_files(files, sort_by, sort_order),
+        "total": len(files),
+        "nextToken": json.dumps(cursors) if cursors else None,
+    }
+
+
+def fetch_files(source, user_id, limit, next_token, sort_order):
+    """
+    Get one page of owned or shared files
+    """
+    if source == "owned":
+        return get_owned_files(user_id, limit, next_token, sort_order)
+    return get_shared_files(user_id, limit, next_token)
+
+
 def get_owned_files(user_id, limit, next_token, sort_order):
     """
     Get files owned by the user
     """
     try:
-        table = dynamodb.Table(FILES_TABLE)
-
         # Build query parameters
         query_params = {
-            "KeyConditionExpression": Key("userId").eq(user_id),
-            "FilterExpression": Attr("status").eq("active"),
+            "TableName": FILES_TABLE,
+            "KeyConditionExpression": "userId = :userId",
+            "FilterExpression": "#status = :active",
+            "ProjectionExpression": FILE_PROJECTION,
+            "ExpressionAttributeNames": {
+                **FILE_PROJECTION_NAMES,
+                "#status": "status",
+            },
+            "ExpressionAttributeValues": serialize_item(
+                {":userId": user_id, ":active": "active"}
+            ),
             "Limit": limit,
             "ScanIndexForward": (sort_order == "asc"),
         }
@@ -124,22 +240,20 @@ def get_owned_files(user_id, limit, next_token, sort_order):
         # Add pagination token if provided
         if next_token:
             try:
-                query_params["ExclusiveStartKey"] = json.loads(next_token)
+                query_params["ExclusiveStartKey"] = serialize_item(
+                    json.loads(next_token)
+                )
             except json.JSONDecodeError:
                 logger.warning(f"Invalid next token: {next_token}")
 
         # Execute query
-        response = table.query(**query_params)
-
-        files = response.get("Items", [])
+        response = dynamodb_client.query(**query_params)
 
-        # Get share counts for each file
-        for file in files:
-            file["sharedWithCount"] = get_share_count(file["fileId"])
+        files = [deserialize_item(item) for item in response.get("Items", [])]
 
         # Prepare next token
         last_key = response.get("LastEvaluatedKey")
-        new_next_token = json.dumps(last_key) if last_key else None
+        new_next_token = json.dumps(deserialize_item(last_key)) if last_key else None
 
         return {"files": files, "total": len(files), "nextToken": new_next_token}
 
@@ -153,60 +267,57 @@ def get_shared_files(user_id, limit, next_token):
     Get files shared with the user
     """
     try:
-        shares_table = dynamodb.Table(SHARES_TABLE)
-        files_table = dynamodb.Table(FILES_TABLE)
-
         # Query shares using GSI
         query_params = {
+            "TableName": SHARES_TABLE,
             "IndexName": "SharedWithUserIndex",
-            "KeyConditionExpression": Key("sharedWithUserId").eq(user_id),
-            "FilterExpression": Attr("status").eq("active"),
+            "KeyConditionExpression": "sharedWithUserId = :userId",
+            # Skip expired shares server-side using the epoch ttl attribute,
+            # since DynamoDB TTL deletion can lag behind the expiry time
+            "FilterExpression": "#status = :active"
+            " AND (attribute_not_exists(#ttl) OR #ttl > :now)",
+            "ExpressionAttributeNames": {"#status": "status", "#ttl": "ttl"},
+            "ExpressionAttributeValues": serialize_item(
+                {":userId": user_id, ":active": "active", ":now": int(time.time())}
+            ),
             "Limit": limit,
         }
 
         if next_token:
             try:
-                query_params["ExclusiveStartKey"] = json.loads(next_token)
+                query_params["ExclusiveStartKey"] = serialize_item(
+                    json.loads(next_token)
+                )
             except json.JSONDecodeError:
                 logger.warning(f"Invalid next token: {next_token}")
 
-        response = shares_table.query(**query_params)
-        shares = response.get("Items", [])
+        response = dynamodb_client.query(**query_params)
+        shares = [deserialize_item(item) for item in response.get("Items", [])]
+
+        # Fetch file metadata for all shares with BatchGetItem
+        files_by_id = batch_get_files(
+            [{"userId": s["ownerId"], "fileId": s["fileId"]} for s in shares],
+            FILE_PROJECTION,
+            FILE_PROJECTION_NAMES,
+        )
 
-        # Get file details for each share
         files = []
         for share in shares:
-            # Check if share has expired
-            if "expiresAt" in share:
-                expiry = datetime.fromisoformat(
-                    share["expiresAt"].replace("Z", "+00:00")
-                )
-                if datetime.utcnow().replace(tzinfo=expiry.tzinfo) > expiry:
-                    continue
-
-            # Get file metadata using GSI
-            try:
-                file_response = files_table.query(
-                    IndexName="FileIdIndex",
-                    KeyConditionExpression=Key("fileId").eq(share["fileId"]),
-                )
-
-                if file_response["Items"]:
-                    file = file_response["Items"][0]
-                    file["sharedBy"] = {
-                        "userId": share["ownerId"],
-                        "email": share.get("sharedWithEmail", ""),
-                    }
-                    file["sharedAt"] = share["sharedAt"]
-                    file["sharePermissions"] = share["permissions"]
-                    file["isShared"] = True
-                    files.append(file)
-            except ClientError as e:
-                logger.error(f"Error getting file {share['fileId']}: {str(e)}")
+            file = files_by_id.get(share["fileId"])
+            if file is None:
                 continue
 
+            file["sharedBy"] = {
+                "userId": share["ownerId"],
+                "email": share.get("sharedWithEmail", ""),
+            }
+            file["sharedAt"] = share["sharedAt"]
+            file["sharePermissions"] = share["permissions"]
+            file["isShared"] = True
+            files.append(file)
+
         last_key = response.get("LastEvaluatedKey")
-        new_next_token = json.dumps(last_key) if last_key else None
+        new_next_token = json.dumps(deserialize_item(last_key)) if last_key else None
 
         return {"files": files, "total": len(files), "nextToken": new_next_token}
 
@@ -215,39 +326,20 @@ def get_shared_files(user_id, limit, next_token):
         return {"files": [], "total": 0, "nextToken": None}
 
 
-def get_share_count(file_id):
-    """
-    Get count of how many users a file is shared with
-    """
-    try:
-        shares_table = dynamodb.Table(SHARES_TABLE)
-
-        response = shares_table.query(
-            KeyConditionExpression=Key("fileId").eq(file_id),
-            FilterExpression=Attr("status").eq("active"),
-            Select="COUNT",
-        )
-
-        return response.get("Count", 0)
-
-    except Exception as e:
-        logger.error(f"Error getting share count: {str(e)}")
-        return 0
-
-
 def sort_files(files, sort_by, sort_order):
     """
     Sort files by specified field
     """
-    valid_sort_fields = ["uploadedAt", "filename", "fileSize", "lastModified"]
-
-    if sort_by not in valid_sort_fields:
+    if sort_by not in VALID_SORT_FIELDS:
         sort_by = "uploadedAt"
 
     reverse = sort_order == "desc"
 
+    def sort_key(x):
+        return x.get(sort_by, "")
+
     try:
-        return sorted(files, key=lambda x: x.get(sort_by, ""), reverse=reverse)
+        return sorted(files, key=sort_key, reverse=reverse)
     except Exception as e:
         logger.error(f"Error sorting files: {str(e)}")
         return files
@@ -255,59 +347,28 @@ def sort_files(files, sort_by, sort_order):
 
 def format_file_item(file_item, current_user_id):
     """
-    Format file item for API response
+    Shape a projected file item into its API form in place
     """
-    formatted = {
-        "fileId": file_item["fileId"],
-        "filename": file_item["filename"],
-        "fileSize": int(file_item["fileSize"]),
-        "contentType": file_item["contentType"],
-        "uploadedAt": file_item["uploadedAt"],
-        "lastModified": file_item.get("lastModified", file_item["uploadedAt"]),
-        "status": file_item["status"],
-        "owner": {
-            "userId": file_item["userId"],
-            "email": file_item.get("ownerEmail", ""),
-        },
-        "isOwner": file_item["userId"] == current_user_id,
-        "description": file_item.get("description", ""),
-        "tags": file_item.get("tags", []),
-        "downloadCount": int(file_item.get("downloadCount", 0)),
-        "virusScanStatus": file_item.get("virusScanStatus", "pending"),
-    }
+    # Items only carry FILE_PROJECTION attributes plus the share fields set in
+    # get_shared_files, so reshaping them avoids building a second dict per file
+    owner_id = file_item.pop("userId")
+    file_item["owner"] = {"userId": owner_id, "email": file_item.pop("ownerEmail", "")}
+    file_item["isOwner"] = owner_id == current_user_id
+    file_item.setdefault("lastModified", file_item["uploadedAt"])
+    file_item.setdefault("description", "")
+    file_item.setdefault("tags", [])
+    # Decimals are emitted as ints by decimal_default at serialization
+    file_item.setdefault("downloadCount", 0)
+    file_item.setdefault("virusScanStatus", "pending")
 
     # Add share-specific fields if this is a shared file
-    if file_item.get("isShared"):
-        formatted["sharedBy"] = file_item.get("sharedBy", {})
-        formatted["sharedAt"] = file_item.get("sharedAt")
-        formatted["sharePermissions"] = file_item.get("sharePermissions", "read")
+    if file_item.pop("isShared", False):
+        file_item.pop("sharedWithCount", None)
+        file_item.setdefault("sharedBy", {})
+        file_item.setdefault("sharedAt", None)
+        file_item.setdefault("sharePermissions", "read")
     else:
         # For owned files, add share count
-        formatted["sharedWithCount"] = int(file_item.get("sharedWithCount", 0))
-
-    return formatted
-
+        file_item.setdefault("sharedWithCount", 0)
 
-def create_response(status_code, body):
-    """
-    Create HTTP response with CORS headers
-    """
-    return {
-        "statusCode": status_code,
-        "headers": {
-            "Content-Type": "application/json",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Headers": "Content-Type,Authorization",
-            "Access-Control-Allow-Methods": "GET,POST,PUT,DELETE,OPTIONS",
-        },
-        "body": json.dumps(body, default=decimal_default),
-    }
-
-
-def decimal_default(obj):
-    """
-    JSON serializer for Decimal objects
-    """
-    if isinstance(obj, Decimal):
-        return int(obj) if obj % 1 == 0 else float(obj)
-    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+    return file_item
@@ -6,28 +6,87 @@ Purpose: Shares a file with other users and manages file sharing permissions
 import json
 import logging
 import os
+import re
+import threading
+import time
 import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from decimal import Decimal
 
-import boto3
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Attr, Key
 from botocore.exceptions import ClientError
 
-# Configure logging
+from common import (
+    batch_get_files,
+    build_projection,
+    boto_config,
+    create_response,
+    deserialize_item,
+    dynamodb_client,
+    serialize_item,
+    session,
+    utc_timestamp,
+)
+
+# Configure logging (the level is set from LOG_LEVEL in common)
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-
-# Initialize AWS clients
-dynamodb = boto3.resource("dynamodb")
-sns_client = boto3.client("sns")
 
 # Environment variables
 FILES_TABLE = os.environ.get("FILES_TABLE", "campus-cloud-files")
 SHARES_TABLE = os.environ.get("SHARES_TABLE", "campus-cloud-shares")
 USERS_TABLE = os.environ.get("USERS_TABLE", "campus-cloud-users")
 SNS_TOPIC_ARN = os.environ.get("SNS_TOPIC_ARN")
+FUNCTION_NAME = os.environ.get("AWS_LAMBDA_FUNCTION_NAME")
 ENABLE_NOTIFICATIONS = os.environ.get("ENABLE_NOTIFICATIONS", "false").lower() == "true"
+BATCH_WRITE_LIMIT = 25
+BATCH_WRITE_MAX_RETRIES = 5
+
+# Rejects malformed addresses before they cost a user lookup
+EMAIL_PATTERN = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+
+# Only the attributes each handler reads; several (status, message,
+# permissions) are reserved words, so every name goes through a placeholder
+FILE_PROJECTION, FILE_PROJECTION_NAMES = build_projection(
+    "fileId", "userId", "filename", "status"
+)
+SHARED_FILE_PROJECTION, SHARED_FILE_PROJECTION_NAMES = build_projection(
+    "fileId", "filename", "fileSize", "contentType"
+)
+FILE_SHARES_PROJECTION, FILE_SHARES_PROJECTION_NAMES = build_projection(
+    "shareId",
+    "sharedWithUserId",
+    "sharedWithEmail",
+    "sharedAt",
+    "permissions",
+    "status",
+    "accessCount",
+    "expiresAt",
+    "lastAccessedAt",
+)
+SHARED_WITH_ME_PROJECTION, SHARED_WITH_ME_PROJECTION_NAMES = build_projection(
+    "fileId", "ownerId", "ownerEmail", "sharedAt", "permissions", "expiresAt", "message"
+)
+
+# Initialize AWS clients and table handles once per container
+# The shared config raises the connection pool so parallel lookups do not
+# queue behind the default of 10 connections
+dynamodb = session.resource("dynamodb", config=boto_config)
+files_table = dynamodb.Table(FILES_TABLE)
+shares_table = dynamodb.Table(SHARES_TABLE)
+sns_client = session.client("sns", config=boto_config)
+lambda_client = session.client("lambda", config=boto_config)
+
+# Worker threads for per-recipient DynamoDB lookups and SNS publishes
+executor = ThreadPoolExecutor(max_workers=16)
+
+# Warm containers reuse recent recipient lookups for a short time. File
+# ownership is always read fresh, since it authorizes the request
+USER_CACHE_TTL = 60
+LOOKUP_CACHE_SIZE = 1024
+user_cache = {}
+# Recipients are looked up on the worker threads, so cache writes take a lock
+cache_lock = threading.Lock()
 
 
 def lambda_handler(event, context):
@@ -39,9 +98,22 @@ def lambda_handler(event, context):
     - GET /files/{fileId}/shares - List file shares
     - DELETE /files/{fileId}/shares/{shareId} - Revoke share
     - GET /shared-with-me - List files shared with user
+
+    Also sends the share notifications queued by an earlier share request,
+    and updates share counts for the expired shares TTL removes.
     """
     try:
-        logger.info(f"Event: {json.dumps(event)}")
+        # Only serialize the full event when debug logging is enabled
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Event: {json.dumps(event)}")
+
+        # Notification jobs come from our own async invoke, not API Gateway
+        if "shareNotifications" in event:
+            return handle_share_notifications(event["shareNotifications"])
+
+        # TTL deletions arrive from the shares table stream
+        if "Records" in event:
+            return handle_expired_shares(event["Records"])
 
         # Extract user info from authorizer context
         user_id = event["requestContext"]["authorizer"]["claims"]["sub"]
@@ -111,21 +183,14 @@ def handle_share_file(event, user_id, user_email, user_name):
             )
 
         # Verify file ownership
-        files_table = dynamodb.Table(FILES_TABLE)
-
         try:
-            file_response = files_table.query(
-                IndexName="FileIdIndex",
-                KeyConditionExpression=Key("fileId").eq(file_id),
-            )
+            file_item = get_file_by_id(file_id)
 
-            if not file_response["Items"]:
+            if not file_item:
                 return create_response(
                     404, {"error": "Not Found", "message": "File not found"}
                 )
 
-            file_item = file_response["Items"][0]
-
             # Check ownership
             if file_item["userId"] != user_id:
                 return create_response(
@@ -149,48 +214,69 @@ def handle_share_file(event, user_id, user_email, user_name):
                 500, {"error": "Database Error", "message": "Failed to retrieve file"}
             )
 
-        # Process each recipient
-        shares_table = dynamodb.Table(SHARES_TABLE)
+        # Every share in the request has the same file, owner, timestamp and
+        # optional fields, so build them once and copy them into each record
+        share_template = {
+            "fileId": file_id,
+            "ownerId": user_id,
+            "sharedAt": utc_timestamp(),
+            "status": "active",
+            "accessCount": 0,
+        }
+
+        # Add optional fields
+        if message:
+            share_template["message"] = message[:500]  # Limit message length
+
+        if expires_at:
+            # Calculate TTL for auto-deletion (Unix timestamp)
+            try:
+                # Python 3.11 parses the trailing "Z" without a replace
+                share_template["ttl"] = int(
+                    datetime.fromisoformat(expires_at).timestamp()
+                )
+                share_template["expiresAt"] = expires_at
+            except (TypeError, ValueError) as e:
+                # Without a TTL the share would never expire, so reject the
+                # request rather than store a permanent share
+                logger.warning(f"Invalid expiry date: {expires_at}, error: {str(e)}")
+                return create_response(
+                    400, {"error": "Bad Request", "message": "Invalid expiresAt"}
+                )
+
+        # Validate recipients and build share records
         successful_shares = []
         failed_shares = []
+        pending_shares = []
+        # (email, permissions) pairs, so later passes skip the dict lookups
+        valid_recipients = []
+        owner_email = user_email.lower()
+        seen_emails = set()
 
         for recipient in recipients:
             recipient_email = recipient.get("email")
-            permissions = recipient.get("permissions", "read")
 
             if not recipient_email:
                 failed_shares.append({"error": "Missing email"})
                 continue
 
             # Validate email format (basic check)
-            if "@" not in recipient_email or "." not in recipient_email:
+            if not EMAIL_PATTERN.fullmatch(recipient_email):
                 failed_shares.append(
                     {"email": recipient_email, "error": "Invalid email format"}
                 )
                 continue
 
             # Prevent sharing with self
-            if recipient_email.lower() == user_email.lower():
+            email_key = recipient_email.lower()
+            if email_key == owner_email:
                 failed_shares.append(
                     {"email": recipient_email, "error": "Cannot share with yourself"}
                 )
                 continue
 
-            # Look up recipient user
-            recipient_user = get_user_by_email(recipient_email)
-
-            if not recipient_user:
-                # For now, we'll allow sharing with emails not in the system
-                # They'll need to sign up to access
-                recipient_user_id = f"pending-{uuid.uuid4()}"
-                logger.info(f"Sharing with non-registered user: {recipient_email}")
-            else:
-                recipient_user_id = recipient_user["userId"]
-
-            # Check if already shared
-            existing_share = check_existing_share(file_id, recipient_user_id)
-
-            if existing_share and existing_share["status"] == "active":
+            # Drop repeated recipients before they cost a lookup each
+            if email_key in seen_emails:
                 failed_shares.append(
                     {
                         "email": recipient_email,
@@ -199,63 +285,91 @@ def handle_share_file(event, user_id, user_email, user_name):
                 )
                 continue
 
+            seen_emails.add(email_key)
+            valid_recipients.append(
+                (recipient_email, recipient.get("permissions", "read"))
+            )
+
+        # Look up all recipient users at the same time
+        recipient_users = executor.map(
+            get_user_by_email, [email for email, _ in valid_recipients]
+        )
+
+        recipient_user_ids = []
+        for (recipient_email, _), recipient_user in zip(
+            valid_recipients, recipient_users
+        ):
+            if not recipient_user:
+                # For now, we'll allow sharing with emails not in the system
+                # They'll need to sign up to access
+                recipient_user_ids.append(f"pending-{uuid.uuid4()}")
+                logger.info(f"Sharing with non-registered user: {recipient_email}")
+            else:
+                recipient_user_ids.append(recipient_user["userId"])
+
+        # Shares that already exist are rejected by the conditional write below
+        for (recipient_email, permissions), recipient_user_id in zip(
+            valid_recipients, recipient_user_ids
+        ):
             # Create share record
-            share_id = str(uuid.uuid4())
-            timestamp = datetime.utcnow().isoformat() + "Z"
+            pending_shares.append(
+                {
+                    **share_template,
+                    "shareId": str(uuid.uuid4()),
+                    "sharedWithUserId": recipient_user_id,
+                    "sharedWithEmail": recipient_email,
+                    "permissions": permissions,
+                }
+            )
 
-            share_item = {
-                "shareId": share_id,
-                "fileId": file_id,
-                "ownerId": user_id,
-                "sharedWithUserId": recipient_user_id,
-                "sharedWithEmail": recipient_email,
-                "permissions": permissions,
-                "sharedAt": timestamp,
-                "status": "active",
-                "accessCount": 0,
-            }
+        # Registered users may already hold an active share, so their records
+        # use conditional puts; a freshly generated pending ID cannot, so those
+        # records are batch written while the puts run
+        registered_shares = []
+        new_shares = []
+        for share_item in pending_shares:
+            if share_item["sharedWithUserId"].startswith("pending-"):
+                new_shares.append(share_item)
+            else:
+                registered_shares.append(share_item)
 
-            # Add optional fields
-            if message:
-                share_item["message"] = message[:500]  # Limit message length
-
-            if expires_at:
-                share_item["expiresAt"] = expires_at
-                # Calculate TTL for auto-deletion (Unix timestamp)
-                try:
-                    expiry_dt = datetime.fromisoformat(
-                        expires_at.replace("Z", "+00:00")
-                    )
-                    share_item["ttl"] = int(expiry_dt.timestamp())
-                except Exception as e:
-                    logger.warning(
-                        f"Invalid expiry date: {expires_at}, error: {str(e)}"
-                    )
+        put_errors = executor.map(put_share_if_new, registered_shares)
+        share_errors = dict.fromkeys(
+            batch_put_shares(new_shares), "Failed to create share"
+        )
+        for share_item, error in zip(registered_shares, put_errors):
+            if error:
+                share_errors[share_item["shareId"]] = error
 
-            try:
-                shares_table.put_item(Item=share_item)
+        for share_item in pending_shares:
+            recipient_email = share_item["sharedWithEmail"]
 
-                successful_shares.append(
-                    {
-                        "shareId": share_id,
-                        "email": recipient_email,
-                        "sharedAt": timestamp,
-                        "expiresAt": expires_at,
-                        "status": "active",
-                    }
-                )
+            error = share_errors.get(share_item["shareId"])
+            if error:
+                failed_shares.append({"email": recipient_email, "error": error})
+                continue
 
-                # Send notification if enabled
-                if ENABLE_NOTIFICATIONS and SNS_TOPIC_ARN:
-                    send_share_notification(
-                        recipient_email, user_name, file_item["filename"], message
-                    )
+            successful_shares.append(
+                {
+                    "shareId": share_item["shareId"],
+                    "email": recipient_email,
+                    "sharedAt": share_item["sharedAt"],
+                    "expiresAt": expires_at,
+                    "status": "active",
+                }
+            )
 
-            except ClientError as e:
-                logger.error(f"Error creating share for {recipient_email}: {str(e)}")
-                failed_shares.append(
-                    {"email": recipient_email, "error": "Failed to create share"}
-                )
+        # Send notifications once the writes are done, off the request path
+        if ENABLE_NOTIFICATIONS and SNS_TOPIC_ARN and successful_shares:
+            queue_share_notifications(
+                [share["email"] for share in successful_shares],
+                user_name,
+                file_item["filename"],
+                message,
+            )
+
+        if successful_shares:
+            adjust_share_count(user_id, file_id, len(successful_shares))
 
         logger.info(
             f"Shared file {file_id}: {len(successful_shares)} successful, {len(failed_shares)} failed"
@@ -298,19 +412,13 @@ def handle_list_shares(event, user_id):
             )
 
         # Verify file ownership
-        files_table = dynamodb.Table(FILES_TABLE)
+        file_item = get_file_by_id(file_id)
 
-        file_response = files_table.query(
-            IndexName="FileIdIndex", KeyConditionExpression=Key("fileId").eq(file_id)
-        )
-
-        if not file_response["Items"]:
+        if not file_item:
             return create_response(
                 404, {"error": "Not Found", "message": "File not found"}
             )
 
-        file_item = file_response["Items"][0]
-
         if file_item["userId"] != user_id:
             return create_response(
                 403,
@@ -320,27 +428,19 @@ def handle_list_shares(event, user_id):
                 },
             )
 
-        # Get all shares for this file
-        shares_table = dynamodb.Table(SHARES_TABLE)
-
-        response = shares_table.query(KeyConditionExpression=Key("fileId").eq(file_id))
+        # Get the active shares for this file
+        response = shares_table.query(
+            KeyConditionExpression=Key("fileId").eq(file_id),
+            FilterExpression=live_share_filter(),
+            ProjectionExpression=FILE_SHARES_PROJECTION,
+            ExpressionAttributeNames=FILE_SHARES_PROJECTION_NAMES,
+        )
 
         shares = response.get("Items", [])
 
-        # Filter active shares and add user details
+        # Add user details
         active_shares = []
         for share in shares:
-            if share["status"] != "active":
-                continue
-
-            # Check if expired
-            if "expiresAt" in share:
-                expiry = datetime.fromisoformat(
-                    share["expiresAt"].replace("Z", "+00:00")
-                )
-                if datetime.utcnow().replace(tzinfo=expiry.tzinfo) > expiry:
-                    continue
-
             formatted_share = {
                 "shareId": share["shareId"],
                 "sharedWith": {
@@ -398,19 +498,13 @@ def handle_revoke_share(event, user_id):
             )
 
         # Verify file ownership
-        files_table = dynamodb.Table(FILES_TABLE)
+        file_item = get_file_by_id(file_id)
 
-        file_response = files_table.query(
-            IndexName="FileIdIndex", KeyConditionExpression=Key("fileId").eq(file_id)
-        )
-
-        if not file_response["Items"]:
+        if not file_item:
             return create_response(
                 404, {"error": "Not Found", "message": "File not found"}
             )
 
-        file_item = file_response["Items"][0]
-
         if file_item["userId"] != user_id:
             return create_response(
                 403,
@@ -421,8 +515,6 @@ def handle_revoke_share(event, user_id):
             )
 
         # Find and revoke the share
-        shares_table = dynamodb.Table(SHARES_TABLE)
-
         # Query share by shareId using GSI
         share_response = shares_table.query(
             IndexName="ShareIdIndex", KeyConditionExpression=Key("shareId").eq(share_id)
@@ -452,10 +544,14 @@ def handle_revoke_share(event, user_id):
             ExpressionAttributeNames={"#status": "status"},
             ExpressionAttributeValues={
                 ":status": "revoked",
-                ":timestamp": datetime.utcnow().isoformat() + "Z",
+                ":timestamp": utc_timestamp(),
             },
         )
 
+        # Only an active share was counted on the file
+        if share["status"] == "active":
+            adjust_share_count(user_id, file_id, -1)
+
         logger.info(f"Revoked share {share_id} for file {file_id}")
 
         return create_response(
@@ -481,13 +577,13 @@ def handle_shared_with_me(event, user_id):
         limit = min(limit, 100)  # Max 100
         next_token = query_params.get("nextToken")
 
-        shares_table = dynamodb.Table(SHARES_TABLE)
-        files_table = dynamodb.Table(FILES_TABLE)
-
         # Query shares using GSI
         query_params = {
             "IndexName": "SharedWithUserIndex",
             "KeyConditionExpression": Key("sharedWithUserId").eq(user_id),
+            "FilterExpression": live_share_filter(),
+            "ProjectionExpression": SHARED_WITH_ME_PROJECTION,
+            "ExpressionAttributeNames": SHARED_WITH_ME_PROJECTION_NAMES,
             "Limit": limit,
         }
 
@@ -498,55 +594,41 @@ def handle_shared_with_me(event, user_id):
                 logger.warning(f"Invalid next token: {next_token}")
 
         response = shares_table.query(**query_params)
-        shares = response.get("Items", [])
+        live_shares = response.get("Items", [])
+
+        # Get file details for all shares with BatchGetItem
+        files_by_id = batch_get_files(
+            [{"userId": s["ownerId"], "fileId": s["fileId"]} for s in live_shares],
+            SHARED_FILE_PROJECTION,
+            SHARED_FILE_PROJECTION_NAMES,
+        )
 
-        # Get file details for each share
         shared_files = []
-        for share in shares:
-            # Skip inactive or expired shares
-            if share["status"] != "active":
+        for share in live_shares:
+            file_item = files_by_id.get(share["fileId"])
+            if file_item is None:
                 continue
 
-            if "expiresAt" in share:
-                expiry = datetime.fromisoformat(
-                    share["expiresAt"].replace("Z", "+00:00")
-                )
-                if datetime.utcnow().replace(tzinfo=expiry.tzinfo) > expiry:
-                    continue
-
-            # Get file metadata
-            try:
-                file_response = files_table.query(
-                    IndexName="FileIdIndex",
-                    KeyConditionExpression=Key("fileId").eq(share["fileId"]),
-                )
-
-                if file_response["Items"]:
-                    file_item = file_response["Items"][0]
-
-                    shared_file = {
-                        "fileId": file_item["fileId"],
-                        "filename": file_item["filename"],
-                        "fileSize": int(file_item["fileSize"]),
-                        "contentType": file_item["contentType"],
-                        "sharedBy": {
-                            "userId": share["ownerId"],
-                            "email": share.get("ownerEmail", ""),
-                        },
-                        "sharedAt": share["sharedAt"],
-                        "permissions": share["permissions"],
-                    }
+            shared_file = {
+                "fileId": file_item["fileId"],
+                "filename": file_item["filename"],
+                "fileSize": file_item["fileSize"],
+                "contentType": file_item["contentType"],
+                "sharedBy": {
+                    "userId": share["ownerId"],
+                    "email": share.get("ownerEmail", ""),
+                },
+                "sharedAt": share["sharedAt"],
+                "permissions": share["permissions"],
+            }
 
-                    if "expiresAt" in share:
-                        shared_file["expiresAt"] = share["expiresAt"]
+            if "expiresAt" in share:
+                shared_file["expiresAt"] = share["expiresAt"]
 
-                    if "message" in share:
-                        shared_file["message"] = share["message"]
+            if "message" in share:
+                shared_file["message"] = share["message"]
 
-                    shared_files.append(shared_file)
-            except ClientError as e:
-                logger.error(f"Error getting file {share['fileId']}: {str(e)}")
-                continue
+            shared_files.append(shared_file)
 
         last_key = response.get("LastEvaluatedKey")
         new_next_token = json.dumps(last_key) if last_key else None
@@ -567,46 +649,228 @@ def handle_shared_with_me(event, user_id):
         )
 
 
+def live_share_filter():
+    """
+    Build the filter that keeps only active, unexpired shares
+    """
+    # Expiring shares carry an epoch ttl, and DynamoDB TTL deletion can lag
+    # behind the expiry time, so compare it here as list_files does
+    return Attr("status").eq("active") & (
+        Attr("ttl").not_exists() | Attr("ttl").gt(int(time.time()))
+    )
+
+
+def batch_put_shares(share_items):
+    """
+    Write share items with BatchWriteItem, returning the shareIds that failed
+    """
+    failed_share_ids = set()
+
+    # BatchWriteItem accepts at most 25 items per request
+    for start in range(0, len(share_items), BATCH_WRITE_LIMIT):
+        request_items = {
+            SHARES_TABLE: [
+                {"PutRequest": {"Item": serialize_item(item)}}
+                for item in share_items[start : start + BATCH_WRITE_LIMIT]
+            ]
+        }
+        attempt = 0
+
+        while request_items:
+            try:
+                response = dynamodb_client.batch_write_item(RequestItems=request_items)
+            except ClientError as e:
+                logger.error(f"Error creating shares: {str(e)}")
+                break
+
+            # Retry throttled items with exponential backoff
+            request_items = response.get("UnprocessedItems")
+            if request_items:
+                if attempt >= BATCH_WRITE_MAX_RETRIES:
+                    logger.warning("Giving up on unprocessed share writes")
+                    break
+                time.sleep(0.05 * (2**attempt))
+                attempt += 1
+
+        if request_items:
+            failed_share_ids.update(
+                request["PutRequest"]["Item"]["shareId"]["S"]
+                for request in request_items[SHARES_TABLE]
+            )
+
+    return failed_share_ids
+
+
+def get_file_by_id(file_id):
+    """
+    Look up file metadata by fileId
+    """
+    response = files_table.query(
+        IndexName="FileIdIndex",
+        KeyConditionExpression=Key("fileId").eq(file_id),
+        ProjectionExpression=FILE_PROJECTION,
+        ExpressionAttributeNames=FILE_PROJECTION_NAMES,
+    )
+
+    if not response["Items"]:
+        return None
+
+    return response["Items"][0]
+
+
 def get_user_by_email(email):
     """
-    Look up user by email address
+    Look up user by email address, reusing a recent lookup in this container
     """
-    try:
-        users_table = dynamodb.Table(USERS_TABLE)
+    email = email.lower()
 
-        response = users_table.query(
+    user = get_cached(user_cache, email, USER_CACHE_TTL)
+    if user is not None:
+        return user
+
+    try:
+        response = dynamodb_client.query(
+            TableName=USERS_TABLE,
             IndexName="EmailIndex",
-            KeyConditionExpression=Key("email").eq(email.lower()),
+            KeyConditionExpression="email = :email",
+            ExpressionAttributeValues={":email": {"S": email}},
         )
 
-        if response["Items"]:
-            return response["Items"][0]
-
-        return None
-    except Exception as e:
+        user = deserialize_item(response["Items"][0]) if response["Items"] else None
+    except ClientError as e:
         logger.error(f"Error looking up user by email: {str(e)}")
         return None
 
+    # Unknown emails are not cached, so a user who signs up is found at once
+    if user is not None:
+        put_cached(user_cache, email, user)
+
+    return user
+
+
+def get_cached(cache, key, ttl):
+    """
+    Return a cache entry stored less than ttl seconds ago, or None
+    """
+    entry = cache.get(key)
+    if entry and time.time() - entry[1] < ttl:
+        return entry[0]
+    return None
+
+
+def put_cached(cache, key, value):
+    """
+    Store a value in a lookup cache, evicting the oldest entry once it is full
+    """
+    # Iterating the dict to find the oldest entry fails if another thread
+    # inserts at the same time
+    with cache_lock:
+        if key not in cache and len(cache) >= LOOKUP_CACHE_SIZE:
+            cache.pop(next(iter(cache)), None)
+        cache[key] = (value, time.time())
+
+
+def put_share_if_new(share_item):
+    """
+    Write a share unless the recipient already has an active share of the
+    file, returning the error for a rejected write
+    """
+    try:
+        # fileId and sharedWithUserId are the full primary key, so the
+        # condition sees any earlier share for this recipient
+        dynamodb_client.put_item(
+            TableName=SHARES_TABLE,
+            Item=serialize_item(share_item),
+            ConditionExpression="attribute_not_exists(fileId) OR #status <> :active",
+            ExpressionAttributeNames={"#status": "status"},
+            ExpressionAttributeValues={":active": {"S": "active"}},
+        )
+        return None
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return "File already shared with this user"
+        logger.error(f"Error creating share: {str(e)}")
+        return "Failed to create share"
+
 
-def check_existing_share(file_id, user_id):
+def adjust_share_count(owner_id, file_id, delta):
     """
-    Check if file is already shared with user
+    Keep the sharedWithCount attribute on the file item in step with its
+    active shares
     """
     try:
-        shares_table = dynamodb.Table(SHARES_TABLE)
+        files_table.update_item(
+            Key={"userId": owner_id, "fileId": file_id},
+            UpdateExpression="ADD sharedWithCount :delta",
+            ExpressionAttributeValues={":delta": delta},
+        )
 
-        response = shares_table.query(
-            KeyConditionExpression=Key("fileId").eq(file_id)
-            & Key("sharedWithUserId").eq(user_id)
+    except ClientError as e:
+        logger.error(f"Error updating share count for {file_id}: {str(e)}")
+
+
+def queue_share_notifications(recipient_emails, sharer_name, filename, message):
+    """
+    Hand share notifications to an async invocation of this function so the
+    share response does not wait for one SNS publish per recipient
+    """
+    job = {
+        "recipientEmails": recipient_emails,
+        "sharerName": sharer_name,
+        "filename": filename,
+        "message": message,
+    }
+
+    if FUNCTION_NAME:
+        try:
+            lambda_client.invoke(
+                FunctionName=FUNCTION_NAME,
+                InvocationType="Event",
+                Payload=json.dumps({"shareNotifications": job}),
+            )
+            return
+        except ClientError as e:
+            logger.error(f"Error queueing share notifications: {str(e)}")
+
+    # Send inline when the async invoke is unavailable or fails
+    handle_share_notifications(job)
+
+
+def handle_share_notifications(job):
+    """
+    Send the notifications for one share request
+    """
+    recipient_emails = job["recipientEmails"]
+
+    # Each publish is its own SNS round trip, so send them at the same time
+    list(
+        executor.map(
+            lambda recipient_email: send_share_notification(
+                recipient_email, job["sharerName"], job["filename"], job.get("message")
+            ),
+            recipient_emails,
         )
+    )
 
-        if response["Items"]:
-            return response["Items"][0]
+    return {"sent": len(recipient_emails)}
 
-        return None
-    except Exception as e:
-        logger.error(f"Error checking existing share: {str(e)}")
-        return None
+
+def handle_expired_shares(records):
+    """
+    Subtract the active shares TTL deleted from their files' share counts
+    """
+    # The stream filter only delivers TTL removals of active shares, so each
+    # record is one share that was still counted
+    expired = Counter()
+    for record in records:
+        share = deserialize_item(record["dynamodb"]["OldImage"])
+        if share.get("status") == "active":
+            expired[(share["ownerId"], share["fileId"])] += 1
+
+    for (owner_id, file_id), count in expired.items():
+        adjust_share_count(owner_id, file_id, -count)
+
+    return {"expired": sum(expired.values())}
 
 
 def send_share_notification(recipient_email, sharer_name, filename, message):
@@ -638,28 +902,3 @@ def send_share_notification(recipient_email, sharer_name, filename, message):
         logger.info(f"Sent share notification to {recipient_email}")
     except Exception as e:
         logger.error(f"Error sending notification: {str(e)}")
-
-
-def create_response(status_code, body):
-    """
-    Create HTTP response with CORS headers
-    """
-    return {
-        "statusCode": status_code,
-        "headers": {
-            "Content-Type": "application/json",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Headers": "Content-Type,Authorization",
-            "Access-Control-Allow-Methods": "GET,POST,PUT,DELETE,OPTIONS",
-        },
-        "body": json.dumps(body, default=decimal_default),
-    }
-
-
-def decimal_default(obj):
-    """
-    JSON serializer for Decimal objects
-    """
-    if isinstance(obj, Decimal):
-        return int(obj) if obj % 1 == 0 else float(obj)
-    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
@@ -6,28 +6,63 @@ Purpose: Handles student assignment submissions and instructor grading
 import json
 import logging
 import os
+import re
+import time
 import uuid
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timezone
 from decimal import Decimal
 
-import boto3
 from boto3.dynamodb.conditions import Attr, Key
 from botocore.exceptions import ClientError
 
-# Configure logging
+from common import (
+    BATCH_GET_MAX_RETRIES,
+    WARM_CLIENTS,
+    boto_config,
+    create_response,
+    deserialize_item,
+    dynamodb_client,
+    serialize_item,
+    session,
+    utc_timestamp,
+)
+
+# Configure logging (the level is set from LOG_LEVEL in common)
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-
-# Initialize AWS clients
-dynamodb = boto3.resource("dynamodb")
-sns_client = boto3.client("sns")
 
 # Environment variables
 FILES_TABLE = os.environ.get("FILES_TABLE", "campus-cloud-files")
 ASSIGNMENTS_TABLE = os.environ.get("ASSIGNMENTS_TABLE", "campus-cloud-assignments")
 SUBMISSIONS_TABLE = os.environ.get("SUBMISSIONS_TABLE", "campus-cloud-submissions")
 SNS_TOPIC_ARN = os.environ.get("SNS_TOPIC_ARN")
+SES_SENDER_EMAIL = os.environ.get("SES_SENDER_EMAIL")
 ENABLE_NOTIFICATIONS = os.environ.get("ENABLE_NOTIFICATIONS", "false").lower() == "true"
+DUE_DATE_CACHE_SIZE = 256
+GRADER_GROUPS = frozenset(["instructor", "admin"])
+GROUP_SEPARATOR = re.compile(r"[,\s]+")
+
+# Only the attributes the statistics fallback counts; status is a reserved word
+STATISTICS_PROJECTION = "isLate, #s"
+STATISTICS_PROJECTION_NAMES = {"#s": "status"}
+
+# Initialize AWS clients and table handles once per container
+# The shared config keeps connections alive between warm invocations
+dynamodb = session.resource("dynamodb", config=boto_config)
+assignments_table = dynamodb.Table(ASSIGNMENTS_TABLE)
+submissions_table = dynamodb.Table(SUBMISSIONS_TABLE)
+sns_client = session.client("sns", config=boto_config)
+# SES is opt-in, so its client is only built when a sender is configured
+ses_client = session.client("sesv2", config=boto_config) if SES_SENDER_EMAIL else None
+
+# Worker threads for overlapping independent DynamoDB and SNS calls. DynamoDB
+# work on these threads goes through the low-level client, because the
+# resource layer's condition builder keeps per-call state and is not safe to
+# share with the handler thread
+executor = ThreadPoolExecutor(max_workers=4)
+
+# Parsed due dates keyed by their ISO string, reused across warm invocations
+due_dates = {}
 
 
 def lambda_handler(event, context):
@@ -41,7 +76,9 @@ def lambda_handler(event, context):
     - GET /assignments/{assignmentId}/submissions/me - Get my submissions
     """
     try:
-        logger.info(f"Event: {json.dumps(event)}")
+        # Only serialize the full event when debug logging is enabled
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Event: {json.dumps(event)}")
 
         # Extract user info from authorizer context
         user_id = event["requestContext"]["authorizer"]["claims"]["sub"]
@@ -49,8 +86,10 @@ def lambda_handler(event, context):
         user_name = event["requestContext"]["authorizer"]["claims"].get(
             "name", user_email
         )
-        user_role = event["requestContext"]["authorizer"]["claims"].get(
-            "cognito:groups", "student"
+        user_groups = parse_user_groups(
+            event["requestContext"]["authorizer"]["claims"].get(
+                "cognito:groups", "student"
+            )
         )
 
         # Determine operation
@@ -62,9 +101,9 @@ def lambda_handler(event, context):
         elif http_method == "GET" and "/submissions" in path and path.endswith("/me"):
             return handle_get_my_submissions(event, user_id)
         elif http_method == "GET" and "/submissions" in path:
-            return handle_list_submissions(event, user_id, user_role)
+            return handle_list_submissions(event, user_id, user_groups)
         elif http_method == "PUT" and "/grade" in path:
-            return handle_grade_submission(event, user_id, user_role, user_name)
+            return handle_grade_submission(event, user_id, user_groups, user_name)
         else:
             return create_response(400, {"error": "Invalid request"})
 
@@ -99,21 +138,50 @@ def handle_submit_assignment(event, user_id, user_email, user_name):
                 400, {"error": "Bad Request", "message": "File ID is required"}
             )
 
-        # Get assignment details
-        assignments_table = dynamodb.Table(ASSIGNMENTS_TABLE)
-
-        assignment_response = assignments_table.query(
-            IndexName="AssignmentIdIndex",
-            KeyConditionExpression=Key("assignmentId").eq(assignment_id),
+        # The sort key starts with the student ID, so only this student's
+        # submissions are read, and only their count is returned. The read is
+        # strongly consistent so a submission stored just before still counts
+        count_future = executor.submit(
+            dynamodb_client.query,
+            TableName=SUBMISSIONS_TABLE,
+            KeyConditionExpression="assignmentId = :assignmentId"
+            " AND begins_with(#studentSubmission, :studentPrefix)",
+            ExpressionAttributeNames={
+                "#studentSubmission": "studentId#submissionNumber"
+            },
+            ExpressionAttributeValues=serialize_item(
+                {":assignmentId": assignment_id, ":studentPrefix": f"{user_id}#"}
+            ),
+            Select="COUNT",
+            ConsistentRead=True,
         )
 
-        if not assignment_response["Items"]:
+        # With the course known both items have full primary keys and come
+        # back from one BatchGetItem; otherwise the file is read while the
+        # assignment is found through the index
+        course_id = (event.get("queryStringParameters") or {}).get("courseId")
+        file_future = None
+        if course_id:
+            assignment, file_item = get_assignment_and_file(
+                course_id, assignment_id, user_id, file_id
+            )
+        else:
+            file_future = executor.submit(
+                dynamodb_client.get_item,
+                TableName=FILES_TABLE,
+                Key=serialize_item({"userId": user_id, "fileId": file_id}),
+            )
+            assignment = None
+
+        # Get assignment details
+        if assignment is None:
+            assignment = get_assignment(assignment_id)
+
+        if assignment is None:
             return create_response(
                 404, {"error": "Not Found", "message": "Assignment not found"}
             )
 
-        assignment = assignment_response["Items"][0]
-
         # Check assignment status
         if assignment["status"] != "active":
             return create_response(
@@ -124,17 +192,17 @@ def handle_submit_assignment(event, user_id, user_email, user_name):
                 },
             )
 
-        # Check deadline
-        due_date = datetime.fromisoformat(assignment["dueDate"].replace("Z", "+00:00"))
-        now = datetime.utcnow().replace(tzinfo=due_date.tzinfo)
-        is_late = now > due_date
+        # Check deadline against the same instant recorded as submittedAt
+        now = datetime.now(timezone.utc)
+        is_late = now > parse_due_date(assignment["dueDate"])
 
         # Verify file ownership and status
-        files_table = dynamodb.Table(FILES_TABLE)
-
-        file_response = files_table.get_item(Key={"userId": user_id, "fileId": file_id})
+        if file_future is not None:
+            file_item = file_future.result().get("Item")
+            if file_item is not None:
+                file_item = deserialize_item(file_item)
 
-        if "Item" not in file_response:
+        if file_item is None:
             return create_response(
                 404,
                 {
@@ -143,8 +211,6 @@ def handle_submit_assignment(event, user_id, user_email, user_name):
                 },
             )
 
-        file_item = file_response["Item"]
-
         if file_item["status"] != "active":
             return create_response(
                 400,
@@ -154,17 +220,17 @@ def handle_submit_assignment(event, user_id, user_email, user_name):
                 },
             )
 
-        # Validate file type
-        if (
-            "allowedFileTypes" in assignment
-            and file_item["contentType"] not in assignment["allowedFileTypes"]
-        ):
+        # Validate file type; allowedFileTypes may be a list or a string set,
+        # which boto3 reads as a Python set with constant-time membership
+        allowed_types = assignment.get("allowedFileTypes")
+        if allowed_types is not None and file_item["contentType"] not in allowed_types:
             return create_response(
                 400,
                 {
                     "error": "Bad Request",
                     "message": f"File type {file_item['contentType']} is not allowed for this assignment",
-                    "allowedTypes": assignment["allowedFileTypes"],
+                    # Sets are not JSON serializable, so always return a list
+                    "allowedTypes": sorted(allowed_types),
                 },
             )
 
@@ -183,14 +249,7 @@ def handle_submit_assignment(event, user_id, user_email, user_name):
             )
 
         # Check submission count
-        submissions_table = dynamodb.Table(SUBMISSIONS_TABLE)
-
-        existing_submissions = submissions_table.query(
-            KeyConditionExpression=Key("assignmentId").eq(assignment_id),
-            FilterExpression=Attr("studentId").eq(user_id),
-        )
-
-        submission_count = len(existing_submissions.get("Items", []))
+        submission_count = count_future.result()["Count"]
         max_submissions = assignment.get("maxSubmissions", 1)
 
         if submission_count >= max_submissions:
@@ -204,12 +263,13 @@ def handle_submit_assignment(event, user_id, user_email, user_name):
 
         # Create submission record
         submission_id = str(uuid.uuid4())
-        timestamp = datetime.utcnow().isoformat() + "Z"
+        timestamp = now.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
         submission_number = submission_count + 1
 
         submission_item = {
             "submissionId": submission_id,
             "assignmentId": assignment_id,
+            "studentId#submissionNumber": f"{user_id}#{submission_number}",
             "studentId": user_id,
             "studentEmail": user_email,
             "studentName": user_name,
@@ -219,6 +279,7 @@ def handle_submit_assignment(event, user_id, user_email, user_name):
             "submittedAt": timestamp,
             "submissionNumber": submission_number,
             "status": "submitted",
+            "status#submittedAt": f"submitted#{timestamp}",
             "isLate": is_late,
             "dueDate": assignment["dueDate"],
         }
@@ -226,27 +287,43 @@ def handle_submit_assignment(event, user_id, user_email, user_name):
         if comments:
             submission_item["comments"] = comments[:1000]  # Limit length
 
-        # Save submission
-        submissions_table.put_item(Item=submission_item)
-
-        # Update assignment submission count
-        assignments_table.update_item(
-            Key={"courseId": assignment["courseId"], "assignmentId": assignment_id},
-            UpdateExpression="SET submissionCount = submissionCount + :inc",
-            ExpressionAttributeValues={":inc": 1},
-        )
-
-        # Send notification to instructor if enabled
-        if ENABLE_NOTIFICATIONS and SNS_TOPIC_ARN:
-            send_submission_notification(
-                assignment["instructorEmail"], user_name, assignment["title"], is_late
+        # Save submission; the key holds the submission number, so when two
+        # submits from the same student race for it only the first is stored
+        try:
+            submissions_table.put_item(
+                Item=submission_item,
+                ConditionExpression="attribute_not_exists(assignmentId)",
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return create_response(
+                    409,
+                    {
+                        "error": "Conflict",
+                        "message": "Another submission is in progress, please try again",
+                    },
+                )
+            raise
+
+        # The submission is stored, so the counter update and the instructor
+        # notification run in the background while the response is built
+        side_effects = [executor.submit(record_submission, assignment, is_late)]
+        if ENABLE_NOTIFICATIONS and (SES_SENDER_EMAIL or SNS_TOPIC_ARN):
+            side_effects.append(
+                executor.submit(
+                    send_submission_notification,
+                    assignment["instructorEmail"],
+                    user_name,
+                    assignment["title"],
+                    is_late,
+                )
             )
 
         logger.info(
             f"Assignment {assignment_id} submitted by {user_id}: submission {submission_id}"
         )
 
-        return create_response(
+        response = create_response(
             201,
             {
                 "submissionId": submission_id,
@@ -266,6 +343,12 @@ def handle_submit_assignment(event, user_id, user_email, user_name):
             },
         )
 
+        # Lambda freezes the container once the handler returns, so the side
+        # effects have to finish first
+        wait(side_effects)
+
+        return response
+
     except json.JSONDecodeError:
         return create_response(
             400, {"error": "Bad Request", "message": "Invalid JSON in request body"}
@@ -277,13 +360,13 @@ def handle_submit_assignment(event, user_id, user_email, user_name):
         )
 
 
-def handle_list_submissions(event, user_id, user_role):
+def handle_list_submissions(event, user_id, user_groups):
     """
     List all submissions for an assignment (instructor only)
     """
     try:
         # Check if user is instructor
-        if "instructor" not in user_role.lower() and "admin" not in user_role.lower():
+        if GRADER_GROUPS.isdisjoint(user_groups):
             return create_response(
                 403,
                 {
@@ -309,20 +392,13 @@ def handle_list_submissions(event, user_id, user_role):
         next_token = query_params.get("nextToken")
 
         # Get assignment details
-        assignments_table = dynamodb.Table(ASSIGNMENTS_TABLE)
-
-        assignment_response = assignments_table.query(
-            IndexName="AssignmentIdIndex",
-            KeyConditionExpression=Key("assignmentId").eq(assignment_id),
-        )
+        assignment = get_assignment(assignment_id, query_params.get("courseId"))
 
-        if not assignment_response["Items"]:
+        if assignment is None:
             return create_response(
                 404, {"error": "Not Found", "message": "Assignment not found"}
             )
 
-        assignment = assignment_response["Items"][0]
-
         # Verify instructor owns this assignment
         if assignment["instructorId"] != user_id:
             return create_response(
@@ -333,16 +409,26 @@ def handle_list_submissions(event, user_id, user_role):
                 },
             )
 
-        # Query submissions
-        submissions_table = dynamodb.Table(SUBMISSIONS_TABLE)
-
-        query_kwargs = {
-            "KeyConditionExpression": Key("assignmentId").eq(assignment_id),
-            "Limit": limit,
-        }
+        # Query submissions; a status filter reads only the matching rows from
+        # the index instead of filtering whole pages of the table
+        if status_filter and counters_cover_submissions(assignment):
+            query_kwargs = {
+                "IndexName": "AssignmentStatusIndex",
+                "KeyConditionExpression": Key("assignmentId").eq(assignment_id)
+                & Key("status#submittedAt").begins_with(f"{status_filter}#"),
+                "Limit": limit,
+            }
+        else:
+            query_kwargs = {
+                "KeyConditionExpression": Key("assignmentId").eq(assignment_id),
+                "Limit": limit,
+            }
 
-        if status_filter:
-            query_kwargs["FilterExpression"] = Attr("status").eq(status_filter)
+            # Submissions from before the index was added have no
+            # status#submittedAt and are missing from it, so assignments that
+            # still hold them are filtered on the table instead
+            if status_filter:
+                query_kwargs["FilterExpression"] = Attr("status").eq(status_filter)
 
         if next_token:
             try:
@@ -353,20 +439,7 @@ def handle_list_submissions(event, user_id, user_role):
         response = submissions_table.query(**query_kwargs)
         submissions = response.get("Items", [])
 
-        # Calculate statistics
-        all_submissions = submissions_table.query(
-            KeyConditionExpression=Key("assignmentId").eq(assignment_id)
-        ).get("Items", [])
-
-        statistics = {
-            "totalSubmissions": len(all_submissions),
-            "onTime": len([s for s in all_submissions if not s.get("isLate", False)]),
-            "late": len([s for s in all_submissions if s.get("isLate", False)]),
-            "graded": len([s for s in all_submissions if s.get("status") == "graded"]),
-            "pending": len(
-                [s for s in all_submissions if s.get("status") == "submitted"]
-            ),
-        }
+        statistics = get_submission_statistics(assignment)
 
         # Format submissions
         formatted_submissions = [format_submission(s) for s in submissions]
@@ -408,11 +481,9 @@ def handle_get_my_submissions(event, user_id):
             )
 
         # Query user's submissions
-        submissions_table = dynamodb.Table(SUBMISSIONS_TABLE)
-
         response = submissions_table.query(
-            KeyConditionExpression=Key("assignmentId").eq(assignment_id),
-            FilterExpression=Attr("studentId").eq(user_id),
+            KeyConditionExpression=Key("assignmentId").eq(assignment_id)
+            & Key("studentId#submissionNumber").begins_with(f"{user_id}#"),
         )
 
         submissions = response.get("Items", [])
@@ -434,13 +505,13 @@ def handle_get_my_submissions(event, user_id):
         )
 
 
-def handle_grade_submission(event, user_id, user_role, user_name):
+def handle_grade_submission(event, user_id, user_groups, user_name):
     """
     Grade a student submission (instructor only)
     """
     try:
         # Check if user is instructor
-        if "instructor" not in user_role.lower() and "admin" not in user_role.lower():
+        if GRADER_GROUPS.isdisjoint(user_groups):
             return create_response(
                 403,
                 {
@@ -475,21 +546,24 @@ def handle_grade_submission(event, user_id, user_role, user_name):
                 400, {"error": "Bad Request", "message": "Grade is required"}
             )
 
-        # Verify assignment ownership
-        assignments_table = dynamodb.Table(ASSIGNMENTS_TABLE)
-
-        assignment_response = assignments_table.query(
-            IndexName="AssignmentIdIndex",
-            KeyConditionExpression=Key("assignmentId").eq(assignment_id),
+        # Look up the submission while assignment ownership is verified
+        submission_future = executor.submit(
+            dynamodb_client.query,
+            TableName=SUBMISSIONS_TABLE,
+            IndexName="SubmissionIdIndex",
+            KeyConditionExpression="submissionId = :submissionId",
+            ExpressionAttributeValues=serialize_item({":submissionId": submission_id}),
         )
 
-        if not assignment_response["Items"]:
+        # Verify assignment ownership
+        query_params = event.get("queryStringParameters") or {}
+        assignment = get_assignment(assignment_id, query_params.get("courseId"))
+
+        if assignment is None:
             return create_response(
                 404, {"error": "Not Found", "message": "Assignment not found"}
             )
 
-        assignment = assignment_response["Items"][0]
-
         if assignment["instructorId"] != user_id:
             return create_response(
                 403,
@@ -500,19 +574,14 @@ def handle_grade_submission(event, user_id, user_role, user_name):
             )
 
         # Get submission
-        submissions_table = dynamodb.Table(SUBMISSIONS_TABLE)
-
-        submission_response = submissions_table.query(
-            IndexName="SubmissionIdIndex",
-            KeyConditionExpression=Key("submissionId").eq(submission_id),
-        )
+        submission_response = submission_future.result()
 
         if not submission_response["Items"]:
             return create_response(
                 404, {"error": "Not Found", "message": "Submission not found"}
             )
 
-        submission = submission_response["Items"][0]
+        submission = deserialize_item(submission_response["Items"][0])
 
         # Verify submission belongs to assignment
         if submission["assignmentId"] != assignment_id:
@@ -525,40 +594,65 @@ def handle_grade_submission(event, user_id, user_role, user_name):
             )
 
         # Update submission with grade
-        timestamp = datetime.utcnow().isoformat() + "Z"
+        timestamp = utc_timestamp()
 
-        update_expression = "SET grade = :grade, maxGrade = :maxGrade, feedback = :feedback, gradedAt = :timestamp, gradedBy = :grader, gradedByName = :graderName, #status = :status"
+        update_expression = "SET grade = :grade, maxGrade = :maxGrade, feedback = :feedback, gradedAt = :timestamp, gradedBy = :grader, gradedByName = :graderName, #status = :status, #statusSubmittedAt = :statusSubmittedAt"
 
         expression_values = {
-            ":grade": Decimal(str(grade)),
-            ":maxGrade": Decimal(str(max_grade)),
+            ":grade": to_dynamodb_number(grade),
+            ":maxGrade": to_dynamodb_number(max_grade),
             ":feedback": feedback[:2000],  # Limit feedback length
             ":timestamp": timestamp,
             ":grader": user_id,
             ":graderName": user_name,
             ":status": "graded",
+            ":statusSubmittedAt": f"graded#{submission['submittedAt']}",
         }
 
         if feedback_file_id:
             update_expression += ", feedbackFileId = :feedbackFileId"
             expression_values[":feedbackFileId"] = feedback_file_id
 
-        submissions_table.update_item(
+        update_response = submissions_table.update_item(
             Key={
                 "assignmentId": assignment_id,
                 "studentId#submissionNumber": f"{submission['studentId']}#{submission['submissionNumber']}",
             },
             UpdateExpression=update_expression,
-            ExpressionAttributeNames={"#status": "status"},
+            ExpressionAttributeNames={
+                "#status": "status",
+                "#statusSubmittedAt": "status#submittedAt",
+            },
             ExpressionAttributeValues=expression_values,
+            ReturnValues="UPDATED_OLD",
         )
 
-        # Send notification to student if enabled
-        if ENABLE_NOTIFICATIONS and SNS_TOPIC_ARN:
-            send_grade_notification(
-                submission["studentEmail"], assignment["title"], grade, max_grade
+        # Send notification to student if enabled, while the counters update
+        notification_future = None
+        if ENABLE_NOTIFICATIONS and (SES_SENDER_EMAIL or SNS_TOPIC_ARN):
+            notification_future = executor.submit(
+                send_grade_notification,
+                submission["studentEmail"],
+                assignment["title"],
+                grade,
+                max_grade,
             )
 
+        # Only the first grade moves a submission from pending to graded; the
+        # old status comes from the update itself so concurrent grades of the
+        # same submission cannot both count it
+        if update_response.get("Attributes", {}).get("status") == "submitted":
+            assignments_table.update_item(
+                Key={"courseId": assignment["courseId"], "assignmentId": assignment_id},
+                UpdateExpression="ADD gradedCount :inc, pendingCount :dec",
+                ExpressionAttributeValues={":inc": 1, ":dec": -1},
+            )
+
+        # Lambda freezes the container once the handler returns, so the
+        # publish has to finish first
+        if notification_future is not None:
+            notification_future.result()
+
         logger.info(f"Graded submission {submission_id}: {grade}/{max_grade}")
 
         return create_response(
@@ -591,10 +685,162 @@ def handle_grade_submission(event, user_id, user_role, user_name):
         )
 
 
+def to_dynamodb_number(value):
+    """
+    Convert a number from a JSON body into a value boto3 can store
+    """
+    # boto3 serializes ints as they are, so only floats and numeric strings
+    # need the Decimal round trip
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    return Decimal(str(value))
+
+
+def parse_user_groups(groups):
+    """
+    Normalize the cognito:groups claim into a set of lowercase group names
+    """
+    # The REST API authorizer passes the claim as a string, either a single
+    # group, comma separated or "[a b]"; other callers may pass a list
+    if isinstance(groups, str):
+        groups = GROUP_SEPARATOR.split(groups.strip("[] "))
+    return {group.strip().lower() for group in groups if group.strip()}
+
+
+def parse_due_date(due_date):
+    """
+    Parse an ISO 8601 due date as an aware UTC datetime, caching the result
+    """
+    parsed = due_dates.get(due_date)
+    if parsed is None:
+        # Python 3.11 parses the Z suffix; dates without an offset are UTC
+        parsed = datetime.fromisoformat(due_date)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        if len(due_dates) >= DUE_DATE_CACHE_SIZE:
+            due_dates.clear()
+        due_dates[due_date] = parsed
+    return parsed
+
+
+def get_assignment(assignment_id, course_id=None):
+    """
+    Get an assignment, reading the base table directly when the course is known
+    """
+    if course_id:
+        item = assignments_table.get_item(
+            Key={"courseId": course_id, "assignmentId": assignment_id}
+        ).get("Item")
+        if item is not None:
+            return item
+
+    # Without a course, or with one that does not match, find it by ID
+    response = assignments_table.query(
+        IndexName="AssignmentIdIndex",
+        KeyConditionExpression=Key("assignmentId").eq(assignment_id),
+    )
+    return response["Items"][0] if response["Items"] else None
+
+
+def get_assignment_and_file(course_id, assignment_id, user_id, file_id):
+    """
+    Read an assignment and a student's file in a single BatchGetItem
+    """
+    request_items = {
+        ASSIGNMENTS_TABLE: {
+            "Keys": [{"courseId": course_id, "assignmentId": assignment_id}]
+        },
+        FILES_TABLE: {"Keys": [{"userId": user_id, "fileId": file_id}]},
+    }
+    assignment = None
+    file_item = None
+    attempt = 0
+
+    while True:
+        response = dynamodb.batch_get_item(RequestItems=request_items)
+        for item in response["Responses"].get(ASSIGNMENTS_TABLE, []):
+            assignment = item
+        for item in response["Responses"].get(FILES_TABLE, []):
+            file_item = item
+
+        # Retry throttled keys with exponential backoff; a missing item is
+        # only reported once every key has been read
+        request_items = response.get("UnprocessedKeys")
+        if not request_items:
+            return assignment, file_item
+        if attempt >= BATCH_GET_MAX_RETRIES:
+            raise RuntimeError("Could not read the assignment and file")
+        time.sleep(0.05 * (2**attempt))
+        attempt += 1
+
+
+def counters_cover_submissions(assignment):
+    """
+    Check whether every submission to the assignment is in its counters
+    """
+    # The counters are kept by submit and grade, which also write the
+    # AssignmentStatusIndex key; assignments with submissions from before
+    # either existed fail these checks
+    total = assignment.get("submissionCount", 0)
+    return (
+        assignment.get("onTimeCount", 0) + assignment.get("lateCount", 0) == total
+        and assignment.get("gradedCount", 0) + assignment.get("pendingCount", 0)
+        == total
+    )
+
+
+def get_submission_statistics(assignment):
+    """
+    Get submission statistics for an assignment
+    """
+    # Assignments with older submissions are counted by query instead
+    if counters_cover_submissions(assignment):
+        return {
+            "totalSubmissions": assignment.get("submissionCount", 0),
+            "onTime": assignment.get("onTimeCount", 0),
+            "late": assignment.get("lateCount", 0),
+            "graded": assignment.get("gradedCount", 0),
+            "pending": assignment.get("pendingCount", 0),
+        }
+
+    # Count every category in a single pass over the submissions, following
+    # LastEvaluatedKey since each query page stops at 1 MB
+    statistics = {
+        "totalSubmissions": 0,
+        "onTime": 0,
+        "late": 0,
+        "graded": 0,
+        "pending": 0,
+    }
+    query_kwargs = {
+        "KeyConditionExpression": Key("assignmentId").eq(assignment["assignmentId"]),
+        "ProjectionExpression": STATISTICS_PROJECTION,
+        "ExpressionAttributeNames": STATISTICS_PROJECTION_NAMES,
+    }
+    while True:
+        response = submissions_table.query(**query_kwargs)
+        for submission in response.get("Items", []):
+            statistics["totalSubmissions"] += 1
+            statistics["late" if submission.get("isLate", False) else "onTime"] += 1
+            status = submission.get("status")
+            if status == "graded":
+                statistics["graded"] += 1
+            elif status == "submitted":
+                statistics["pending"] += 1
+
+        if "LastEvaluatedKey" not in response:
+            break
+        query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    return statistics
+
+
 def format_submission(submission):
     """
     Format submission for API response
     """
+    # Numbers stay Decimal here; decimal_default emits them as ints or floats
+    # when the response is encoded
     formatted = {
         "submissionId": submission["submissionId"],
         "student": {
@@ -604,9 +850,9 @@ def format_submission(submission):
         },
         "fileId": submission["fileId"],
         "filename": submission["filename"],
-        "fileSize": int(submission["fileSize"]),
+        "fileSize": submission["fileSize"],
         "submittedAt": submission["submittedAt"],
-        "submissionNumber": int(submission["submissionNumber"]),
+        "submissionNumber": submission["submissionNumber"],
         "status": submission["status"],
         "isLate": submission.get("isLate", False),
     }
@@ -615,8 +861,8 @@ def format_submission(submission):
         formatted["comments"] = submission["comments"]
 
     if "grade" in submission:
-        formatted["grade"] = float(submission["grade"])
-        formatted["maxGrade"] = float(submission.get("maxGrade", 100))
+        formatted["grade"] = submission["grade"]
+        formatted["maxGrade"] = submission.get("maxGrade", 100)
 
     if "feedback" in submission:
         formatted["feedback"] = submission["feedback"]
@@ -634,6 +880,32 @@ def format_submission(submission):
     return formatted
 
 
+def record_submission(assignment, is_late):
+    """
+    Add a new submission to the assignment's submission and statistics counters
+    """
+    timing_count = "lateCount" if is_late else "onTimeCount"
+    try:
+        dynamodb_client.update_item(
+            TableName=ASSIGNMENTS_TABLE,
+            Key=serialize_item(
+                {
+                    "courseId": assignment["courseId"],
+                    "assignmentId": assignment["assignmentId"],
+                }
+            ),
+            UpdateExpression=f"ADD submissionCount :inc, pendingCount :inc, {timing_count} :inc",
+            ExpressionAttributeValues=serialize_item({":inc": 1}),
+        )
+
+    except ClientError as e:
+        # The submission itself is stored, so a failed counter update must not
+        # fail the request and invite a duplicate resubmission
+        logger.error(
+            f"Error updating submission counters for {assignment['assignmentId']}: {str(e)}"
+        )
+
+
 def send_submission_notification(
     instructor_email, student_name, assignment_title, is_late
 ):
@@ -651,14 +923,7 @@ def send_submission_notification(
         Log in to Campus Cloud to review and grade the submission.
         """
 
-        sns_client.publish(
-            TopicArn=SNS_TOPIC_ARN,
-            Subject=subject,
-            Message=body,
-            MessageAttributes={
-                "email": {"DataType": "String", "StringValue": instructor_email}
-            },
-        )
+        deliver_notification(instructor_email, subject, body)
 
         logger.info(f"Sent submission notification to {instructor_email}")
     except Exception as e:
@@ -680,40 +945,53 @@ def send_grade_notification(student_email, assignment_title, grade, max_grade):
         Log in to Campus Cloud to view detailed feedback.
         """
 
-        sns_client.publish(
-            TopicArn=SNS_TOPIC_ARN,
-            Subject=subject,
-            Message=body,
-            MessageAttributes={
-                "email": {"DataType": "String", "StringValue": student_email}
-            },
-        )
+        deliver_notification(student_email, subject, body)
 
         logger.info(f"Sent grade notification to {student_email}")
     except Exception as e:
         logger.error(f"Error sending notification: {str(e)}")
 
 
-def create_response(status_code, body):
+def deliver_notification(recipient_email, subject, body):
     """
-    Create HTTP response with CORS headers
+    Email a single recipient, directly through SES when a sender is configured
     """
-    return {
-        "statusCode": status_code,
-        "headers": {
-            "Content-Type": "application/json",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Headers": "Content-Type,Authorization",
-            "Access-Control-Allow-Methods": "GET,POST,PUT,DELETE,OPTIONS",
+    # Every notification has exactly one recipient, so SES skips the topic
+    # fan-out and subscription filtering that SNS routing needs
+    if SES_SENDER_EMAIL:
+        ses_client.send_email(
+            FromEmailAddress=SES_SENDER_EMAIL,
+            Destination={"ToAddresses": [recipient_email]},
+            Content={
+                "Simple": {
+                    "Subject": {"Data": subject},
+                    "Body": {"Text": {"Data": body}},
+                }
+            },
+        )
+        return
+
+    sns_client.publish(
+        TopicArn=SNS_TOPIC_ARN,
+        Subject=subject,
+        Message=body,
+        MessageAttributes={
+            "email": {"DataType": "String", "StringValue": recipient_email}
         },
-        "body": json.dumps(body, default=decimal_default),
-    }
+    )
 
 
-def decimal_default(obj):
+def warm_clients():
     """
-    JSON serializer for Decimal objects
+    Open the DynamoDB connection during INIT so the first request does not
+    pay for loading the service model, endpoint resolution and the TLS handshake
     """
-    if isinstance(obj, Decimal):
-        return int(obj) if obj % 1 == 0 else float(obj)
-    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+    try:
+        dynamodb.meta.client.describe_table(TableName=ASSIGNMENTS_TABLE)
+    except Exception as e:
+        logger.warning(f"Client warmup failed: {str(e)}")
+
+
+# Prime connections at cold start when enabled
+if WARM_CLIENTS:
+    warm_clients()
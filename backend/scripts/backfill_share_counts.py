@@ -0,0 +1,104 @@
+"""
+Script: Backfill Share Counts
+Purpose: Recomputes sharedWithCount on every file item from the shares table
+
+Run once after deploying the stored share counts, and again whenever the
+counts need repairing. Every active share still in the table is counted,
+including expiring ones, since their TTL deletion subtracts them again.
+
+Usage:
+    FILES_TABLE=campus-cloud-dev-files SHARES_TABLE=campus-cloud-dev-shares \\
+        python backend/scripts/backfill_share_counts.py [--dry-run]
+"""
+
+import argparse
+import os
+from collections import Counter
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+
+# Environment variables
+FILES_TABLE = os.environ.get("FILES_TABLE", "campus-cloud-files")
+SHARES_TABLE = os.environ.get("SHARES_TABLE", "campus-cloud-shares")
+
+
+def scan_all(table, **scan_kwargs):
+    """
+    Yield every item a scan returns, following LastEvaluatedKey
+    """
+    while True:
+        response = table.scan(**scan_kwargs)
+        yield from response.get("Items", [])
+
+        last_key = response.get("LastEvaluatedKey")
+        if not last_key:
+            return
+        scan_kwargs["ExclusiveStartKey"] = last_key
+
+
+def count_shares(shares_table):
+    """
+    Count the active shares of each file
+    """
+    counts = Counter()
+    for share in scan_all(
+        shares_table,
+        FilterExpression=Attr("status").eq("active"),
+        ProjectionExpression="#p0, #p1",
+        ExpressionAttributeNames={"#p0": "ownerId", "#p1": "fileId"},
+    ):
+        counts[(share["ownerId"], share["fileId"])] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[1])
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="report the counts that would change without writing them",
+    )
+    args = parser.parse_args()
+
+    dynamodb = boto3.resource("dynamodb")
+    files_table = dynamodb.Table(FILES_TABLE)
+
+    counts = count_shares(dynamodb.Table(SHARES_TABLE))
+    print(f"Counted shares for {len(counts)} files in {SHARES_TABLE}")
+
+    checked = 0
+    updated = 0
+    for file_item in scan_all(
+        files_table,
+        ProjectionExpression="#p0, #p1, #p2",
+        ExpressionAttributeNames={
+            "#p0": "userId",
+            "#p1": "fileId",
+            "#p2": "sharedWithCount",
+        },
+    ):
+        checked += 1
+        count = counts.get((file_item["userId"], file_item["fileId"]), 0)
+        if file_item.get("sharedWithCount", 0) == count:
+            continue
+
+        updated += 1
+        if args.dry_run:
+            print(
+                f"{file_item['fileId']}: {file_item.get('sharedWithCount', 0)} -> {count}"
+            )
+            continue
+
+        files_table.update_item(
+            Key={"userId": file_item["userId"], "fileId": file_item["fileId"]},
+            UpdateExpression="SET sharedWithCount = :count",
+            ExpressionAttributeValues={":count": count},
+        )
+
+    action = "Would update" if args.dry_run else "Updated"
+    print(f"{action} {updated} of {checked} files in {FILES_TABLE}")
+
+
+if __name__ == "__main__":
+    main()